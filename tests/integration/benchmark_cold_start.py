@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Run from the repository root with the website's environment, for example
+# FLASK_SECRET_KEY=x python tests/integration/benchmark_cold_start.py
+
+REPEAT = 10
+TOP_MODULES = 25
+
+
+def cold_start(module: str) -> float:
+    # A fresh interpreter per run, like a gunicorn worker respawn without
+    # preload_app
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - started
+
+
+def import_times(module: str) -> list:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            check=True, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return rows
+
+
+def report(module: str, top: int):
+    rows = import_times(module)
+    print(f'{"cumulative ms":>13} {"self ms":>8}  module')
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f'{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {name}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='website.wsgi')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--top', type=int, default=TOP_MODULES)
+    args = parser.parse_args()
+
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    report(args.module, args.top)
+
+    cold_start(args.module)
+    timings = [cold_start(args.module) for _ in range(args.repeat)]
+    print(f'cold start of {args.module} over {args.repeat} runs')
+    print(f'median {statistics.median(timings) * 1000:.1f} ms, '
+          f'min {min(timings) * 1000:.1f} ms, '
+          f'max {max(timings) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from websocket.executors import run_query
+
+SESSIONS = 500
+QUERIES_PER_SESSION = 4
+QUERY_LATENCY = 0.002
+TICK = 0.005
+
+
+def blocking_query(session_id: int):
+    # Stand-in for a psycopg2 round trip, which releases the GIL while waiting
+    time.sleep(QUERY_LATENCY)
+    return session_id
+
+
+async def monitor_stalls(stalls: list, stop: asyncio.Event):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK)
+        stalls.append(max(loop.time() - started - TICK, 0))
+
+
+async def blocking_session(session_id: int):
+    for _ in range(QUERIES_PER_SESSION):
+        blocking_query(session_id)
+        await asyncio.sleep(0)
+
+
+async def executor_session(session_id: int):
+    for _ in range(QUERIES_PER_SESSION):
+        await run_query(blocking_query, session_id)
+
+
+async def measure(session_coroutine) -> dict:
+    stalls = []
+    stop = asyncio.Event()
+    monitor = asyncio.ensure_future(monitor_stalls(stalls, stop))
+    await asyncio.sleep(TICK)
+    started = time.perf_counter()
+    await asyncio.gather(*[session_coroutine(i) for i in range(SESSIONS)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    return {
+        'elapsed': elapsed,
+        'max_stall': max(stalls),
+        'total_stall': sum(stalls)
+    }
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    for name, session_coroutine in (('blocking', blocking_session),
+                                    ('executor', executor_session)):
+        result = loop.run_until_complete(measure(session_coroutine))
+        print(f'{name:>8}: {SESSIONS} sessions in {result["elapsed"]:.2f}s, '
+              f'max stall {result["max_stall"] * 1000:.1f}ms, '
+              f'total stall {result["total_stall"] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
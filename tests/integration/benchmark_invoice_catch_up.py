@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+
+from lnd_grpc.protos import rpc_pb2
+
+from lnd_sql import session_scope
+from lnd_sql.models import Invoices
+from lnd_sql.scripts.upsert_invoices import UpsertInvoices
+from websocket.async_client import AsyncClient
+from websocket.invoice_server import InvoiceServer
+from websocket.queries import InvoiceQueries
+from websocket.queries.invoice_queries import invoice_server_state
+
+# Deletes every row of the invoices table. It only runs when the database
+# that session_scope connects to is named in LPU_BENCHMARK_DATABASE, so
+# point the LPU_PG* settings at a throwaway database first
+BENCHMARK_DATABASE = os.environ.get('LPU_BENCHMARK_DATABASE', None)
+
+INVOICES = 100000
+SETTLED_DURING_DOWNTIME = 20000
+# Most capacity requests are abandoned, only the newest invoices have not
+# expired yet
+UNEXPIRED_INVOICES = 25000
+EXPIRY = 3600
+ROW_BY_ROW_SAMPLE = 2000
+LOCAL_PUBKEY = '02' + '00' * 32
+
+
+def make_invoices() -> list:
+    now = int(time.time())
+    invoices = []
+    for add_index in range(1, INVOICES + 1):
+        if add_index > INVOICES - UNEXPIRED_INVOICES:
+            creation_date = now
+        else:
+            creation_date = now - 2 * EXPIRY
+        invoices.append(rpc_pb2.Invoice(
+            memo='benchmark',
+            r_hash=os.urandom(32),
+            r_preimage=os.urandom(32),
+            value=1000,
+            creation_date=creation_date,
+            payment_request='lnbc' + os.urandom(16).hex(),
+            expiry=EXPIRY,
+            add_index=add_index
+        ))
+    return invoices
+
+
+def settle(invoices: list, count: int, first_settle_index: int):
+    now = int(time.time())
+    for i, invoice in enumerate(invoices[-count:]):
+        invoice.settled = True
+        invoice.settle_date = now
+        invoice.amt_paid_sat = invoice.value
+        invoice.settle_index = first_settle_index + i
+
+
+class FakeClient(object):
+    def __init__(self, invoices: list):
+        self.invoices = invoices
+
+    def get_info(self):
+        return rpc_pb2.GetInfoResponse(identity_pubkey=LOCAL_PUBKEY)
+
+    def list_invoices(self, index_offset: int = 0,
+                      num_max_invoices: int = 100, reversed: bool = True):
+        # Pages like LND and with lnd_grpc's default direction, add_index
+        # is the position in the list plus one
+        if reversed:
+            end = index_offset - 1 if index_offset else len(self.invoices)
+            page = self.invoices[max(end - num_max_invoices, 0):end]
+        else:
+            page = self.invoices[index_offset:index_offset + num_max_invoices]
+        return rpc_pb2.ListInvoiceResponse(
+            invoices=page,
+            first_index_offset=page[0].add_index if page else index_offset,
+            last_index_offset=page[-1].add_index if page else index_offset
+        )
+
+
+def check_database():
+    with session_scope() as session:
+        database = session.execute('SELECT current_database()').scalar()
+    if BENCHMARK_DATABASE is None or database != BENCHMARK_DATABASE:
+        raise SystemExit(
+            f'Refusing to clear invoices in {database!r}, set '
+            f'LPU_BENCHMARK_DATABASE={database} if it is a throwaway database'
+        )
+
+
+def clear_invoices():
+    with session_scope() as session:
+        session.query(Invoices).delete()
+        session.execute(invoice_server_state.delete())
+
+
+async def catch_up(invoices: list) -> float:
+    server = InvoiceServer(rpc=AsyncClient(FakeClient(invoices)))
+    server.local_pubkey = LOCAL_PUBKEY
+    server.workers.start()
+    started = time.perf_counter()
+    await server.catch_up()
+    await server.workers.join()
+    elapsed = time.perf_counter() - started
+    await server.workers.close()
+    return elapsed
+
+
+def row_by_row(invoices: list) -> float:
+    started = time.perf_counter()
+    for invoice in invoices:
+        UpsertInvoices.upsert(single_invoice=invoice,
+                              local_pubkey=LOCAL_PUBKEY)
+    return time.perf_counter() - started
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    check_database()
+    InvoiceQueries.create_table()
+    invoices = make_invoices()
+
+    clear_invoices()
+    elapsed = row_by_row(invoices[:ROW_BY_ROW_SAMPLE])
+    print(f'row by row: {ROW_BY_ROW_SAMPLE} invoices in {elapsed:.2f}s, '
+          f'~{elapsed * INVOICES / ROW_BY_ROW_SAMPLE:.0f}s for {INVOICES}')
+
+    clear_invoices()
+    elapsed = loop.run_until_complete(catch_up(invoices))
+    print(f'cold catch-up: {INVOICES} invoices in {elapsed:.2f}s')
+
+    # Restart after a crash, some open invoices were paid in the meantime
+    settle(invoices, SETTLED_DURING_DOWNTIME, first_settle_index=1)
+    elapsed = loop.run_until_complete(catch_up(invoices))
+    print(f'restart catch-up: {SETTLED_DURING_DOWNTIME} settled during '
+          f'downtime in {elapsed:.2f}s')
+
+    # Paging starts at the oldest unexpired open invoice, not at the
+    # oldest abandoned one
+    cursor = InvoiceQueries.get_catch_up_cursor()
+    assert cursor['index_offset'] == INVOICES - UNEXPIRED_INVOICES
+    elapsed = loop.run_until_complete(catch_up(invoices))
+    print(f'restart with nothing missed: {elapsed:.2f}s from index offset '
+          f'{cursor["index_offset"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import time
+
+from websocket.async_client import AsyncClient
+from websocket.executors import run_query
+from websocket.worker_pool import KeyedWorkerPool
+
+SETTLEMENTS = 1000
+UPSERT_LATENCY = 0.004
+LOOKUP_LATENCY = 0.002
+SEND_LATENCY = 0.001
+
+
+class FakeInvoice(object):
+    def __init__(self, add_index: int):
+        self.r_hash = os.urandom(32)
+        self.add_index = add_index
+        self.settle_date = int(time.time())
+
+
+class FakeClient(object):
+    def subscribe_invoices(self, add_index: int = 0):
+        # A burst of settlements replayed by the gRPC stream
+        for i in range(add_index + 1, add_index + SETTLEMENTS + 1):
+            yield FakeInvoice(i)
+
+
+async def handle_invoice(invoice: FakeInvoice):
+    await run_query(time.sleep, UPSERT_LATENCY)
+    await run_query(time.sleep, LOOKUP_LATENCY)
+    await asyncio.sleep(SEND_LATENCY)
+    await asyncio.sleep(SEND_LATENCY)
+
+
+async def replay(workers: int) -> float:
+    rpc = AsyncClient(FakeClient())
+    pool = KeyedWorkerPool(handler=handle_invoice, workers=workers,
+                           max_pending=64)
+    pool.start()
+    started = time.perf_counter()
+    async for invoice in rpc.stream('subscribe_invoices', add_index=0,
+                                    max_pending=64):
+        await pool.submit(invoice.r_hash, invoice)
+    await pool.join()
+    elapsed = time.perf_counter() - started
+    await pool.close()
+    return elapsed
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    for workers in (1, 4, 8, 16):
+        elapsed = loop.run_until_complete(replay(workers))
+        print(f'{workers:>2} workers: {SETTLEMENTS} settlements in '
+              f'{elapsed:.2f}s ({SETTLEMENTS / elapsed:.0f}/s)')
+
+
+if __name__ == '__main__':
+    main()
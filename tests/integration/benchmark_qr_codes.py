@@ -0,0 +1,34 @@
+import json
+import random
+import string
+import timeit
+
+from websocket.qr_codes import render_matrix, render_png, render_svg
+
+# Typical BOLT11 lengths: bare invoice, with memo, with routing hints
+PAYMENT_REQUEST_LENGTHS = (190, 280, 400)
+REPEAT = 20
+
+
+def fake_uri(length: int) -> str:
+    bech32 = string.ascii_lowercase + string.digits
+    payment_request = 'lnbc' + ''.join(random.choice(bech32)
+                                       for _ in range(length - 4))
+    return 'lightning:' + payment_request
+
+
+def main():
+    print(f'{"length":>6} {"format":>7} {"ms/render":>10} {"bytes":>8}')
+    for length in PAYMENT_REQUEST_LENGTHS:
+        uri = fake_uri(length)
+        for name, renderer in (('png', render_png),
+                               ('svg', render_svg),
+                               ('matrix', render_matrix)):
+            seconds = timeit.timeit(lambda: renderer(uri), number=REPEAT)
+            size = len(json.dumps(renderer(uri)))
+            print(f'{length:>6} {name:>7} {seconds / REPEAT * 1000:>10.2f} '
+                  f'{size:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import gc
+import uuid
+
+import psutil
+
+from websocket.main_server.sessions import session_registry
+from websocket.main_server.sessions.session import AWAITING_PAYMENT
+from websocket.main_server.sessions.session_registry import SessionRegistry
+from websocket.queries import InboundCapacityRequestQueries
+
+SESSIONS = 100000
+SAMPLE_EVERY = 10000
+
+# Lower caps than production so that both eviction paths run many times
+MAX_SESSIONS = 2000
+MAX_SESSION_RECORDS = 5000
+
+# Every nth browser leaves a capacity request waiting on payment, so its
+# session is compacted into a record when evicted
+IN_FLIGHT_EVERY = 10
+
+# Once both caps are reached resident size should stay flat
+MAX_RESIDENT_GROWTH = 10
+
+
+class FakeWebsocket(object):
+    closed = False
+    # Sockets the registry closed when it evicted their session
+    evicted = 0
+
+    async def send_str(self, data):
+        pass
+
+    async def close(self):
+        self.closed = True
+        FakeWebsocket.evicted += 1
+
+
+class FakeInfo(object):
+    identity_pubkey = 'fake_pubkey'
+
+
+class FakeClient(object):
+    def get_info(self):
+        return FakeInfo()
+
+
+class FakeAsyncClient(object):
+    client = FakeClient()
+
+
+def resident_megabytes() -> float:
+    gc.collect()
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+async def register(registry: SessionRegistry, i: int):
+    session_id = uuid.uuid4().hex
+    await registry.handle_session_message(
+        session_id=session_id,
+        data_from_client={'action': 'register'},
+        session_websocket=FakeWebsocket()
+    )
+    # Browsers never disconnect here, only eviction removes their sessions
+    if not i % IN_FLIGHT_EVERY:
+        session = registry.sessions[session_id]
+        session.state = AWAITING_PAYMENT
+        session.request_id = i
+
+
+async def main():
+    # Only the registry is measured, the database insert is skipped
+    InboundCapacityRequestQueries.insert = staticmethod(lambda session_id: None)
+    session_registry.MAX_SESSIONS = MAX_SESSIONS
+    session_registry.MAX_SESSION_RECORDS = MAX_SESSION_RECORDS
+    registry = SessionRegistry(FakeAsyncClient())
+
+    samples = []
+    # Samples taken once both caps had been reached
+    steady = []
+    for i in range(1, SESSIONS + 1):
+        await register(registry, i)
+        assert len(registry.sessions) <= MAX_SESSIONS
+        assert len(registry.records) <= MAX_SESSION_RECORDS
+        if not i % SAMPLE_EVERY:
+            samples.append(resident_megabytes())
+            if len(registry.records) == MAX_SESSION_RECORDS:
+                steady.append(samples[-1])
+            print(f'{i:>7} sessions: {samples[-1]:.1f}MB resident, '
+                  f'{len(registry.sessions)} live, '
+                  f'{len(registry.records)} records')
+
+    # Least recently used eviction kept the newest sessions and compacted
+    # the in-flight ones it evicted
+    assert len(registry.sessions) == MAX_SESSIONS
+    assert len(registry.records) == MAX_SESSION_RECORDS
+    assert all(r.state == AWAITING_PAYMENT for r in registry.records.values())
+    # Evicted browsers were disconnected so that their pages register again
+    await asyncio.sleep(0)
+    assert FakeWebsocket.evicted == SESSIONS - MAX_SESSIONS
+
+    growth = max(steady) - steady[0]
+    print(f'Resident size growth once the caps were reached: '
+          f'{growth:.1f}MB over {len(steady)} samples')
+    assert len(steady) > 1
+    assert growth < MAX_RESIDENT_GROWTH
+
+    # Age everything past the idle and record TTLs instead of waiting
+    for session in registry.sessions.values():
+        session.last_activity -= session_registry.SESSION_IDLE_TTL + 1
+    registry.evict_idle()
+    await asyncio.sleep(0)
+    assert FakeWebsocket.evicted == SESSIONS
+    print(f'After idle eviction: {len(registry.sessions)} live, '
+          f'{len(registry.records)} records')
+    assert not registry.sessions
+    assert len(registry.records) == MAX_SESSION_RECORDS
+
+    for record in registry.records.values():
+        record.updated_at -= session_registry.SESSION_RECORD_TTL + 1
+    registry.evict_idle()
+    print(f'After record expiry: {len(registry.records)} records, '
+          f'{resident_megabytes():.1f}MB resident')
+    assert not registry.records
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import time
+from concurrent import futures
+
+import grpc
+from lnd_grpc.protos import rpc_pb2, rpc_pb2_grpc
+
+from websocket.async_client import AsyncClient
+from websocket.executors import RPC_POOL_SIZE
+from websocket.main_server.peer_connector import PeerConnector
+from websocket.main_server.sessions.session import Session
+from websocket.queries import (
+    InboundCapacityRequestQueries,
+    LightningAddressesQueries
+)
+
+FAKE_LND_PORT = 50551
+HANG_SECONDS = 10
+SESSIONS = 50
+
+# More hanging connects than the RPC pool has threads
+CONNECTING_SESSIONS = RPC_POOL_SIZE * 2
+GRAPH_ADDRESSES = ['10.255.255.2:9735', '10.255.255.3:9735']
+
+
+class FakeLightning(rpc_pb2_grpc.LightningServicer):
+    def GetInfo(self, request, context):
+        return rpc_pb2.GetInfoResponse(identity_pubkey='fake_pubkey')
+
+    def ConnectPeer(self, request, context):
+        # An unreachable peer: LND waits for the whole connect timeout
+        time.sleep(HANG_SECONDS)
+        context.abort(grpc.StatusCode.UNKNOWN, 'dial tcp: i/o timeout')
+
+
+class InsecureClient(object):
+    def __init__(self, port: int):
+        channel = grpc.insecure_channel(f'localhost:{port}')
+        self.lightning_stub = rpc_pb2_grpc.LightningStub(channel)
+
+    def get_info(self):
+        return self.lightning_stub.GetInfo(rpc_pb2.GetInfoRequest())
+
+
+class FakeWebsocket(object):
+    closed = False
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_str(self, data):
+        self.messages.append(json.loads(data))
+
+
+class DisconnectedPeerSet(object):
+    async def is_connected(self, remote_pubkey: str) -> bool:
+        return False
+
+    def add(self, remote_pubkey: str):
+        pass
+
+
+def connecting_session(rpc: AsyncClient, connector: PeerConnector) -> Session:
+    return Session(
+        session_id='connect-hang',
+        local_pubkey='fake_pubkey',
+        ws=FakeWebsocket(),
+        rpc=rpc,
+        connector=connector,
+        channel_index=None,
+        peer_set=DisconnectedPeerSet(),
+        wallet=None
+    )
+
+
+async def responsive_session(rpc: AsyncClient) -> float:
+    started = time.perf_counter()
+    await rpc.get_info()
+    return time.perf_counter() - started
+
+
+async def main():
+    # Only LND is faked over gRPC, the database calls are skipped
+    LightningAddressesQueries.get = staticmethod(
+        lambda remote_pubkey: GRAPH_ADDRESSES
+    )
+    InboundCapacityRequestQueries.update_many = staticmethod(
+        lambda updates: None
+    )
+
+    server = grpc.server(futures.ThreadPoolExecutor(
+        max_workers=CONNECTING_SESSIONS * 3 + SESSIONS
+    ))
+    rpc_pb2_grpc.add_LightningServicer_to_server(FakeLightning(), server)
+    server.add_insecure_port(f'localhost:{FAKE_LND_PORT}')
+    server.start()
+
+    rpc = AsyncClient(InsecureClient(FAKE_LND_PORT))
+    connector = PeerConnector(rpc)
+    sessions = [connecting_session(rpc, connector)
+                for _ in range(CONNECTING_SESSIONS)]
+    pubkey_input = '02' + '00' * 32 + '@10.255.255.1:9735'
+    started = time.perf_counter()
+    connecting = asyncio.ensure_future(asyncio.gather(
+        *[session.connect_to_peer(pubkey_input) for session in sessions]
+    ))
+    await asyncio.sleep(1)
+
+    latencies = await asyncio.gather(
+        *[responsive_session(rpc) for _ in range(SESSIONS)]
+    )
+    slowest = max(latencies)
+    print(f'{SESSIONS} sessions answered while {CONNECTING_SESSIONS} '
+          f'connects hang, slowest {slowest * 1000:.1f}ms')
+    assert not connecting.done()
+    assert slowest < 1, 'sessions were blocked by the hanging connects'
+
+    await connecting
+    elapsed = time.perf_counter() - started
+    print(f'Hanging connects failed after {elapsed:.1f}s')
+    for session in sessions:
+        errors = [m for m in session.ws.messages if 'error' in m]
+        assert errors, 'session was not told that the connect failed'
+    server.stop(0)
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,78 @@
+import random
+import statistics
+
+# Models what batching paid opens into one funding transaction would save.
+# The pinned lnd_grpc 0.4.0 has no BatchOpenChannel or PSBT funding, so the
+# channel opening server still opens each channel on its own
+
+# Segwit v0 sizes in vbytes
+TX_OVERHEAD = 10.5
+P2WPKH_INPUT = 68
+P2WSH_OUTPUT = 43
+P2WPKH_OUTPUT = 31
+
+# Paid capacity requests per hour and how long the simulation runs
+ARRIVALS_PER_HOUR = 30
+HOURS = 24 * 30
+
+
+def funding_vbytes(channels: int) -> float:
+    # One wallet input and a change output per funding transaction
+    return (TX_OVERHEAD + P2WPKH_INPUT + P2WPKH_OUTPUT
+            + channels * P2WSH_OUTPUT)
+
+
+def arrivals(seed: int = 1) -> list:
+    rng = random.Random(seed)
+    times = []
+    now = 0.0
+    while now < HOURS * 3600:
+        now += rng.expovariate(ARRIVALS_PER_HOUR / 3600)
+        times.append(now)
+    return times
+
+
+def simulate(times: list, window: float, max_size: int):
+    # A batch is opened once max_size requests wait or window seconds
+    # after its first request, whichever comes first
+    batches = []
+    waits = []
+    batch = []
+    for arrived in times:
+        if batch and arrived - batch[0] >= window:
+            opened = batch[0] + window
+            waits.extend(opened - t for t in batch)
+            batches.append(len(batch))
+            batch = []
+        batch.append(arrived)
+        if len(batch) >= max_size:
+            waits.extend(arrived - t for t in batch)
+            batches.append(len(batch))
+            batch = []
+    if batch:
+        waits.extend(batch[0] + window - t for t in batch)
+        batches.append(len(batch))
+    channels = sum(batches)
+    vbytes = sum(funding_vbytes(size) for size in batches)
+    return vbytes / channels, statistics.mean(waits), \
+        sorted(waits)[int(len(waits) * 0.95)], statistics.mean(batches)
+
+
+def main():
+    times = arrivals()
+    print(f'{len(times)} paid requests at {ARRIVALS_PER_HOUR}/hour')
+    print(f'{"window":>7} {"size":>5} {"batch":>6} {"vB/chan":>8} '
+          f'{"wait":>7} {"p95":>7}')
+    for window in (0, 30, 120, 600):
+        for max_size in (1, 5, 10, 25):
+            if window == 0 and max_size > 1:
+                continue
+            per_channel, wait, p95, mean_batch = simulate(
+                times, window=window, max_size=max_size
+            )
+            print(f'{window:>6}s {max_size:>5} {mean_batch:>6.2f} '
+                  f'{per_channel:>8.1f} {wait:>6.1f}s {p95:>6.1f}s')
+
+
+if __name__ == '__main__':
+    main()
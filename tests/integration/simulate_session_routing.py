@@ -0,0 +1,119 @@
+import asyncio
+import json
+import uuid
+
+from websocket.main_server.routing_bus import LocalRoutingBus
+from websocket.main_server.sessions import session_registry
+from websocket.main_server.sessions.session import AWAITING_PAYMENT
+from websocket.main_server.sessions.session_registry import SessionRegistry
+from websocket.queries import InboundCapacityRequestQueries
+
+# Long enough for the local bus to hand a message to the other worker
+SETTLE = 0.1
+
+CHANNEL_OPEN = {
+    'action': 'channel_open',
+    'open_channel_update': {'chan_pending': {'txid': '00' * 32}}
+}
+
+
+class FakeWebsocket(object):
+    def __init__(self):
+        self.closed = False
+        self.messages = []
+
+    async def send_str(self, data):
+        self.messages.append(json.loads(data))
+
+    async def close(self):
+        self.closed = True
+
+    def actions(self) -> list:
+        return [message['action'] for message in self.messages]
+
+
+class FakeInfo(object):
+    identity_pubkey = 'fake_pubkey'
+
+
+class FakeClient(object):
+    def get_info(self):
+        return FakeInfo()
+
+
+class FakeAsyncClient(object):
+    client = FakeClient()
+
+
+async def start_worker(hub: list) -> SessionRegistry:
+    # Only the routing is exercised, the peer and price tasks stay stopped
+    registry = SessionRegistry(FakeAsyncClient(), bus=LocalRoutingBus(hub))
+    await registry.bus.start(registry.handle_bus_message)
+    return registry
+
+
+async def register(registry: SessionRegistry, session_id: str,
+                   websocket: FakeWebsocket):
+    await registry.handle_session_message(
+        session_id=session_id,
+        data_from_client={'action': 'register'},
+        session_websocket=websocket
+    )
+
+
+async def main():
+    # The capacity request rows are not written, only the routing is checked
+    InboundCapacityRequestQueries.insert = staticmethod(lambda session_id: 1)
+    InboundCapacityRequestQueries.update_many = staticmethod(
+        lambda updates: None
+    )
+    session_registry.DELIVERY_TIMEOUT = SETTLE * 5
+
+    hub = []
+    first = await start_worker(hub)
+    second = await start_worker(hub)
+
+    # The invoice server's link lands on the worker without the session,
+    # which forwards the payment to the owner and hears it was delivered
+    session_id = uuid.uuid4().hex
+    first_websocket = FakeWebsocket()
+    await register(first, session_id, first_websocket)
+    first.sessions[session_id].state = AWAITING_PAYMENT
+    await second.route_session_message(session_id, {
+        'action': 'receive_payment'
+    })
+    await asyncio.sleep(SETTLE)
+    assert first_websocket.actions() == ['registered', 'receive_payment']
+    assert not second.deliveries
+    print('deliver: receive_payment reached the owning worker')
+
+    # The browser goes away while the channel opens, the owner keeps the
+    # message it could not send
+    await first.unregister(session_id, session_websocket=first_websocket)
+    await second.route_session_message(session_id, CHANNEL_OPEN)
+    await asyncio.sleep(SETTLE)
+    assert first.records[session_id].undelivered['action'] == 'channel_open'
+    assert not second.deliveries
+
+    # The page registers again on the other worker, which claims the
+    # session and replays the message handed over in the restore
+    second_websocket = FakeWebsocket()
+    await register(second, session_id, second_websocket)
+    await asyncio.sleep(SETTLE)
+    assert second_websocket.actions() == ['registered', 'channel_open']
+    assert not first.owns(session_id)
+    assert second.owns(session_id)
+    print('claim and restore: channel_open replayed on the new worker')
+
+    # A message for a session no worker owns is reported once it times out
+    await first.route_session_message(uuid.uuid4().hex, {
+        'action': 'receive_payment'
+    })
+    assert len(first.deliveries) == 1
+    await asyncio.sleep(session_registry.DELIVERY_TIMEOUT + SETTLE)
+    assert not first.deliveries
+    print('unowned session: delivery logged as lost')
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -47,3 +47,13 @@ BEGIN
    RETURN result;
 END;
 $$ LANGUAGE plpgsql;
+
+
+-- Statement level, tells website caches that a table changed without
+-- sending rows to the transactional e-mail listener on table_update
+CREATE OR REPLACE FUNCTION cache_invalidate_notify() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify('cache_invalidate', TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
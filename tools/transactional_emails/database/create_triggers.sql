@@ -47,4 +47,14 @@ CREATE TRIGGER pending_open_channels_notify_delete
 DROP TRIGGER IF EXISTS forwarding_events_notify_insert ON forwarding_events;
 CREATE TRIGGER forwarding_events_notify_insert
   AFTER INSERT ON forwarding_events
-  FOR EACH ROW EXECUTE PROCEDURE table_notify();
\ No newline at end of file
+  FOR EACH ROW EXECUTE PROCEDURE table_notify();
+
+DROP TRIGGER IF EXISTS smart_fee_estimates_cache_invalidate ON smart_fee_estimates;
+CREATE TRIGGER smart_fee_estimates_cache_invalidate
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON smart_fee_estimates
+  FOR EACH STATEMENT EXECUTE PROCEDURE cache_invalidate_notify();
+
+DROP TRIGGER IF EXISTS exchange_rates_cache_invalidate ON exchange_rates;
+CREATE TRIGGER exchange_rates_cache_invalidate
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON exchange_rates
+  FOR EACH STATEMENT EXECUTE PROCEDURE cache_invalidate_notify();
@@ -1,3 +1,4 @@
+import functools
 import os
 import platform
 from datetime import timedelta
@@ -46,6 +47,9 @@ PROGRAMS = os.environ.get('Programw6432', '')
 
 FLASK_SECRET_KEY = os.environ['FLASK_SECRET_KEY']
 
+# Unset keeps /cache_stats disabled
+CACHE_STATS_TOKEN = os.environ.get('CACHE_STATS_TOKEN', None)
+
 WEBSITE_DATA_PATHS: Dict[OperatingSystem, str] = {
     DARWIN: expanduser('~/Library/Application Support/Node Website/'),
     LINUX: expanduser('~/.node_website'),
@@ -53,13 +57,14 @@ WEBSITE_DATA_PATHS: Dict[OperatingSystem, str] = {
 }
 WEBSITE_DATA_PATH = WEBSITE_DATA_PATHS[OPERATING_SYSTEM]
 
-if not os.path.exists(WEBSITE_DATA_PATH):
-    os.mkdir(WEBSITE_DATA_PATH)
-
 CACHE_PATH = os.path.join(WEBSITE_DATA_PATH, 'cache')
 
-if not os.path.exists(CACHE_PATH):
-    os.mkdir(CACHE_PATH)
+
+def ensure_cache_path() -> str:
+    # Created by whoever writes to it first rather than on import
+    os.makedirs(CACHE_PATH, exist_ok=True)
+    return CACHE_PATH
+
 
 EXPECTED_BYTES = 500
 
@@ -72,17 +77,28 @@ CAPACITY_FEE_RATES = [
     (Decimal('0.03'), 'One month 3%', timedelta(days=31))
 ]
 
-if IS_WINDOWS:
-    from keyring.backends.Windows import WinVaultKeyring
 
-    keyring = WinVaultKeyring()
+@functools.lru_cache()
+def get_keyring():
+    if IS_WINDOWS:
+        from keyring.backends.Windows import WinVaultKeyring
+
+        return WinVaultKeyring()
+
+    if IS_MACOS:
+        from keyring.backends.OS_X import Keyring
+
+        return Keyring()
 
-if IS_MACOS:
-    from keyring.backends.OS_X import Keyring
+    if IS_LINUX:
+        from keyring.backends.SecretService import Keyring
 
-    keyring = Keyring()
+        return Keyring()
 
-if IS_LINUX:
-    from keyring.backends.SecretService import Keyring
 
-    keyring = Keyring()
+def __getattr__(name):
+    # The keyring backends are slow to import, so `keyring` is only created
+    # when something imports it
+    if name == 'keyring':
+        return get_keyring()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
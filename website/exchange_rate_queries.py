@@ -0,0 +1,21 @@
+from typing import Optional
+
+from bitcoin.core import COIN
+
+from lnd_sql import session_scope
+from lnd_sql.models import ExchangeRates
+
+
+class ExchangeRateQueries(object):
+    @staticmethod
+    def get_price_per_sat() -> Optional[float]:
+        with session_scope() as session:
+            last_price = (
+                session.query(ExchangeRates.last)
+                    .order_by(ExchangeRates.timestamp.desc())
+                    .limit(1)
+                    .scalar()
+            )
+            if last_price is None:
+                return None
+            return float(last_price / COIN)
@@ -1,6 +1,15 @@
 from flask_caching import Cache
 from flask_webpack import Webpack
 
-cache = Cache(config={'CACHE_TYPE': 'simple'})
+from website.constants import CACHE_PATH
+
+# One SQLite file shared by every gunicorn worker, see website/sqlite_cache.py
+cache = Cache(config={
+    'CACHE_TYPE': 'website.sqlite_cache.SQLiteCache',
+    'CACHE_DIR': CACHE_PATH,
+    'CACHE_DEFAULT_TIMEOUT': 300,
+    'CACHE_THRESHOLD': 1000,
+    'CACHE_MAX_BYTES': 64 * 1024 * 1024
+})
 
 webpack = Webpack()
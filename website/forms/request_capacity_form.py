@@ -7,6 +7,7 @@ from bitcoin.core import COIN
 from lnd_sql import session_scope
 from lnd_sql.models import SmartFeeEstimates
 from website.constants import CAPACITY_CHOICES, CAPACITY_FEE_RATES
+from website.table_cache import TableCache
 
 
 class RequestCapacityForm(FlaskForm):
@@ -24,8 +25,10 @@ class RequestCapacityForm(FlaskForm):
     request_capacity = SubmitField('Request Capacity')
 
 
-def get_request_capacity_form() -> RequestCapacityForm:
-    form = RequestCapacityForm()
+FEE_ESTIMATE_CHOICES_TTL = 60
+
+
+def load_fee_estimate_choices() -> list:
     fee_estimate_choices = []
     previous_estimate = 0
     with session_scope() as session:
@@ -45,8 +48,19 @@ def get_request_capacity_form() -> RequestCapacityForm:
                 select_label = f'{select_label_time_estimate} (1 sat per byte)'
             select_value = estimated_fee_per_byte
             fee_estimate_choices.append((select_value, select_label))
+    return fee_estimate_choices
+
 
-    form.transaction_fee_rate.choices = fee_estimate_choices
+fee_estimate_choices = TableCache(
+    model=SmartFeeEstimates,
+    load=load_fee_estimate_choices,
+    ttl=FEE_ESTIMATE_CHOICES_TTL
+)
+
+
+def get_request_capacity_form() -> RequestCapacityForm:
+    form = RequestCapacityForm()
+    form.transaction_fee_rate.choices = list(fee_estimate_choices.get())
     form.capacity.choices = []
     form.capacity.choices.append((0, 'Reciprocate'))
     for capacity_choice in CAPACITY_CHOICES:
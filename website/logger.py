@@ -9,42 +9,58 @@ pre_chain = [
     timestamper,
 ]
 
-logging.config.dictConfig({
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'plain': {
-            '()': structlog.stdlib.ProcessorFormatter,
-            'processor': structlog.dev.ConsoleRenderer(colors=False),
-            'foreign_pre_chain': pre_chain,
-        },
-        'colored': {
-            '()': structlog.stdlib.ProcessorFormatter,
-            'processor': structlog.dev.ConsoleRenderer(colors=True),
-            'foreign_pre_chain': pre_chain,
-        },
-    },
-    'handlers': {
-        'default': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'colored',
-        },
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.handlers.WatchedFileHandler',
-            'filename': 'debug.log',
-            'formatter': 'plain',
+logging_configured = False
+
+
+def configure_logging():
+    # Run on first use of a logger rather than on import, so that importing
+    # a module does not open debug.log
+    global logging_configured
+    if logging_configured:
+        return
+    logging_configured = True
+    logging.config.dictConfig({
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'plain': {
+                '()': structlog.stdlib.ProcessorFormatter,
+                'processor': structlog.dev.ConsoleRenderer(colors=False),
+                'foreign_pre_chain': pre_chain,
+            },
+            'colored': {
+                '()': structlog.stdlib.ProcessorFormatter,
+                'processor': structlog.dev.ConsoleRenderer(colors=True),
+                'foreign_pre_chain': pre_chain,
+            },
         },
-    },
-    'loggers': {
-        '': {
-            'handlers': ['default', 'file'],
-            'level': 'DEBUG',
-            'propagate': True,
+        'handlers': {
+            'default': {
+                'level': 'DEBUG',
+                'class': 'logging.StreamHandler',
+                'formatter': 'colored',
+            },
+            'file': {
+                'level': 'DEBUG',
+                'class': 'logging.handlers.WatchedFileHandler',
+                'filename': 'debug.log',
+                'formatter': 'plain',
+            },
         },
-    }
-})
+        'loggers': {
+            '': {
+                'handlers': ['default', 'file'],
+                'level': 'DEBUG',
+                'propagate': True,
+            },
+        }
+    })
+
+
+class LoggerFactory(structlog.stdlib.LoggerFactory):
+    def __call__(self, *args):
+        configure_logging()
+        return super().__call__(*args)
 
 
 def dropper(logger, method_name, event_dict):
@@ -65,7 +81,7 @@ structlog.configure(
         dropper
     ],
     context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
+    logger_factory=LoggerFactory(),
     wrapper_class=structlog.stdlib.BoundLogger,
     cache_logger_on_first_use=True,
 )
@@ -1,14 +1,16 @@
+import hmac
 import logging
 import sys
 
 import structlog
-from flask import Flask, redirect, url_for
+from flask import Flask, abort, jsonify, redirect, request, url_for
 from flask_admin import Admin
 from flask_assets import Environment, Bundle
 from flask_qrcode import QRcode
 
-from website.constants import FLASK_SECRET_KEY
+from website.constants import CACHE_STATS_TOKEN, FLASK_SECRET_KEY
 from website.extensions import cache
+from website.logger import LoggerFactory
 from website.views.home_view import HomeView
 
 
@@ -30,7 +32,7 @@ class App(Flask):
                 )
             ],
             context_class=structlog.threadlocal.wrap_dict(dict),
-            logger_factory=structlog.stdlib.LoggerFactory(),
+            logger_factory=LoggerFactory(),
         )
         assets = Environment(self)
 
@@ -47,6 +49,19 @@ class App(Flask):
         def index():
             return redirect(url_for('home.index'))
 
+        @self.route('/cache_stats')
+        def cache_stats():
+            # Only served to callers holding CACHE_STATS_TOKEN
+            authorization = request.headers.get('Authorization', '')
+            if CACHE_STATS_TOKEN is None or not hmac.compare_digest(
+                    authorization, f'Bearer {CACHE_STATS_TOKEN}'):
+                abort(404)
+            return jsonify(cache.cache.stats())
+
+        @self.teardown_request
+        def release_cache_leases(exception):
+            cache.cache.release_leases()
+
         @self.errorhandler(404)
         def page_not_found(e):
             return redirect(url_for('home.index'))
@@ -0,0 +1,256 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from flask_caching.backends.base import BaseCache
+
+from website.logger import log
+
+DEFAULT_THRESHOLD = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# A worker that misses takes a lease and computes the value, the others
+# wait for it instead of calling LND as well. Leases a request did not
+# fill are released when it ends, see release_leases
+LEASE_TIMEOUT = 30
+WAIT_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+
+# Sets between evictions and lookups between counter flushes
+EVICT_EVERY = 50
+FLUSH_STATS_EVERY = 100
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value BLOB NOT NULL,'
+    ' expires REAL NOT NULL,'
+    ' size INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS leases ('
+    ' key TEXT PRIMARY KEY,'
+    ' expires REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS stats ('
+    ' name TEXT PRIMARY KEY,'
+    ' value INTEGER NOT NULL)',
+)
+
+STATS = ('hits', 'misses', 'waits', 'evictions')
+
+
+class SQLiteCache(BaseCache):
+    # Shared by every gunicorn worker on the host through one SQLite file
+    def __init__(self, path: str, default_timeout: int = 300,
+                 threshold: int = DEFAULT_THRESHOLD,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__(default_timeout=default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.counts = dict.fromkeys(STATS, 0)
+        self.lookups = 0
+        self.sets = 0
+        self.lock = threading.Lock()
+        with self.connection() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        os.makedirs(config['CACHE_DIR'], exist_ok=True)
+        return cls(
+            path=os.path.join(config['CACHE_DIR'], 'flask_cache.sqlite3'),
+            default_timeout=config.get('CACHE_DEFAULT_TIMEOUT', 300),
+            threshold=config.get('CACHE_THRESHOLD', DEFAULT_THRESHOLD),
+            max_bytes=config.get('CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        # Connections are not shared across threads or forked workers
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def expires_at(self, timeout: Optional[int]) -> float:
+        timeout = self._normalize_timeout(timeout)
+        if timeout == 0:
+            return float('inf')
+        return time.time() + timeout
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+            self.lookups += 1
+            if self.lookups < FLUSH_STATS_EVERY:
+                return
+            counts, self.counts = self.counts, dict.fromkeys(STATS, 0)
+            self.lookups = 0
+        self.flush_stats(counts)
+
+    def flush_stats(self, counts: dict):
+        with self.connection() as connection:
+            for name, value in counts.items():
+                connection.execute(
+                    'INSERT INTO stats (name, value) VALUES (?, ?) '
+                    'ON CONFLICT (name) DO UPDATE '
+                    'SET value = value + excluded.value',
+                    (name, value)
+                )
+
+    def stats(self) -> dict:
+        rows = self.connection().execute(
+            'SELECT name, value FROM stats'
+        ).fetchall()
+        stats = dict.fromkeys(STATS, 0)
+        stats.update(rows)
+        for name, value in self.counts.items():
+            stats[name] += value
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+        row = self.connection().execute(
+            'SELECT count(*), coalesce(sum(size), 0) FROM cache'
+        ).fetchone()
+        stats['entries'], stats['bytes'] = row
+        return stats
+
+    def lookup(self, key: str) -> Optional[bytes]:
+        row = self.connection().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?',
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def held_leases(self) -> set:
+        leases = getattr(self.local, 'leases', None)
+        if leases is None or self.local.leases_pid != os.getpid():
+            leases = self.local.leases = set()
+            self.local.leases_pid = os.getpid()
+        return leases
+
+    def take_lease(self, key: str) -> bool:
+        now = time.time()
+        with self.connection() as connection:
+            connection.execute('DELETE FROM leases WHERE key = ? '
+                               'AND expires <= ?', (key, now))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO leases (key, expires) VALUES (?, ?)',
+                (key, now + LEASE_TIMEOUT)
+            )
+            taken = cursor.rowcount == 1
+        if taken:
+            self.held_leases().add(key)
+        return taken
+
+    def release_leases(self):
+        # Called when a request ends, a lease its thread took but never
+        # filled means the computation failed and the waiters can stop
+        leases = self.held_leases()
+        if not leases:
+            return
+        with self.connection() as connection:
+            connection.executemany('DELETE FROM leases WHERE key = ?',
+                                   [(key,) for key in leases])
+        leases.clear()
+
+    def get(self, key: str) -> Any:
+        value = self.lookup(key)
+        if value is None and not self.take_lease(key):
+            self.count('waits')
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while value is None and time.monotonic() < deadline:
+                time.sleep(WAIT_INTERVAL)
+                value = self.lookup(key)
+                # The lease was released without a value, compute it here
+                if value is None and self.take_lease(key):
+                    break
+        if value is None:
+            self.count('misses')
+            return None
+        self.count('hits')
+        return pickle.loads(value)
+
+    def get_many(self, *keys: str) -> list:
+        values = [self.lookup(key) for key in keys]
+        return [None if v is None else pickle.loads(v) for v in values]
+
+    def has(self, key: str) -> bool:
+        return self.lookup(key) is not None
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, size) '
+                'VALUES (?, ?, ?, ?)',
+                (key, data, self.expires_at(timeout), len(data))
+            )
+            connection.execute('DELETE FROM leases WHERE key = ?', (key,))
+        self.held_leases().discard(key)
+        self.sets += 1
+        if self.sets % EVICT_EVERY == 0:
+            self.evict()
+        return True
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.connection() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ? '
+                               'AND expires <= ?', (key, time.time()))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, size) '
+                'VALUES (?, ?, ?, ?)',
+                (key, data, self.expires_at(timeout), len(data))
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key: str) -> bool:
+        with self.connection() as connection:
+            cursor = connection.execute('DELETE FROM cache WHERE key = ?',
+                                        (key,))
+            return cursor.rowcount == 1
+
+    def clear(self) -> bool:
+        with self.connection() as connection:
+            connection.execute('DELETE FROM cache')
+            connection.execute('DELETE FROM leases')
+        return True
+
+    def evict(self):
+        # Expired entries go first, then the ones closest to expiring until
+        # both the entry and the byte bounds hold
+        with self.connection() as connection:
+            now = time.time()
+            evicted = connection.execute(
+                'DELETE FROM cache WHERE expires <= ?', (now,)
+            ).rowcount
+            connection.execute('DELETE FROM leases WHERE expires <= ?',
+                               (now,))
+            count, size = connection.execute(
+                'SELECT count(*), coalesce(sum(size), 0) FROM cache'
+            ).fetchone()
+            rows = connection.execute(
+                'SELECT key, size FROM cache ORDER BY expires'
+            ) if count > self.threshold or size > self.max_bytes else []
+            doomed = []
+            for key, entry_size in rows:
+                if count <= self.threshold and size <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                count -= 1
+                size -= entry_size
+            connection.executemany('DELETE FROM cache WHERE key = ?', doomed)
+            evicted += len(doomed)
+        if evicted:
+            log.debug('Evicted cache entries', evicted=evicted)
+            with self.lock:
+                self.counts['evictions'] += evicted
@@ -152,16 +152,36 @@ document.addEventListener('DOMContentLoaded', async function () {
         errorMessageRow.style.display = "none";
     }
 
-    session_websocket.onopen = function (event) {
+    function renderQrMatrix(rows, border) {
+        const scale = 10;
+        const size = (rows.length + 2 * border) * scale;
+        const canvas = document.createElement('canvas');
+        canvas.width = size;
+        canvas.height = size;
+        const context = canvas.getContext('2d');
+        context.fillStyle = '#ffffff';
+        context.fillRect(0, 0, size, size);
+        context.fillStyle = '#000000';
+        rows.forEach(function (row, y) {
+            for (let x = 0; x < row.length; x++) {
+                if (row[x] === '1') {
+                    context.fillRect((x + border) * scale, (y + border) * scale, scale, scale);
+                }
+            }
+        });
+        return canvas.toDataURL('image/png');
+    }
+
+    function onWebsocketOpen(event) {
         const session_id_object = {
             session_id: session_id,
             action: "register"
         };
 
         websocketSend(session_id_object);
-    };
+    }
 
-    session_websocket.onmessage = function (event) {
+    function onWebsocketMessage(event) {
         const msg = JSON.parse(event.data);
         switch(msg.action) {
             case "registered":
@@ -219,7 +239,13 @@ document.addEventListener('DOMContentLoaded', async function () {
                 hideProgressBar();
 
                 const image = document.getElementById("qrcode");
-                image.src = msg.qrcode;
+                if (msg.qrcode_matrix) {
+                    image.src = renderQrMatrix(msg.qrcode_matrix, msg.qrcode_border);
+                } else if (msg.qrcode_svg) {
+                    image.src = 'data:image/svg+xml;charset=utf-8,' + encodeURIComponent(msg.qrcode_svg);
+                } else {
+                    image.src = msg.qrcode;
+                }
                 qrCodeDiv.appendChild(image);
 
                 payWithJoule.href = msg.uri;
@@ -259,6 +285,10 @@ document.addEventListener('DOMContentLoaded', async function () {
                     }
                 };
                 break;
+            case "price_update":
+                pricePerSat = msg.price_per_sat;
+                changeEventHandler();
+                break;
             case "error_message":
                 console.log("error message");
                 document.onkeydown = null;
@@ -269,7 +299,22 @@ document.addEventListener('DOMContentLoaded', async function () {
                 connectTextarea.disabled = false;
                 break;
         }
-    };
+    }
+
+    function onWebsocketClose(event) {
+        // The server closes sessions it evicts, register again on a new socket
+        setTimeout(function () {
+            session_websocket = new WebSocket(session_websocket.url);
+            watchWebsocket();
+        }, 1000);
+    }
+
+    function watchWebsocket() {
+        session_websocket.onopen = onWebsocketOpen;
+        session_websocket.onmessage = onWebsocketMessage;
+        session_websocket.onclose = onWebsocketClose;
+    }
+    watchWebsocket();
 
     function connectFormSubmit(event) {
         event.preventDefault();
@@ -324,6 +369,7 @@ document.addEventListener('DOMContentLoaded', async function () {
         const chainFormDataObject = {
             session_id: session_id,
             action: 'chain_fee',
+            qr_format: 'matrix',
             form_data: formData
         };
         websocketSend(chainFormDataObject);
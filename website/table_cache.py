@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+import pgpubsub
+
+from lnd_sql.database.session import keyring_get_or_create
+from website.logger import log
+
+CACHE_INVALIDATE_CHANNEL = 'cache_invalidate'
+
+LISTEN_RETRY_DELAY = 5
+
+
+class TableListener(object):
+    # Calls back on cache_invalidate_notify() notifications, see
+    # tools/transactional_emails/database/create_triggers.sql
+    callbacks: Dict[str, List[Callable]]
+
+    def __init__(self):
+        self.callbacks = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def subscribe(self, table_name: str, callback: Callable):
+        with self.lock:
+            self.callbacks.setdefault(table_name, []).append(callback)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.listen,
+                                               name='table-listener',
+                                               daemon=True)
+                self.thread.start()
+
+    def dispatch(self, table_name: str):
+        for callback in self.callbacks.get(table_name, []):
+            callback()
+
+    def listen(self):
+        while True:
+            # noinspection PyBroadException
+            try:
+                pubsub = pgpubsub.connect(
+                    database=keyring_get_or_create('LPU_PGDATABASE'),
+                    user=keyring_get_or_create('LPU_PGUSER'),
+                    password=keyring_get_or_create('LPU_PGPASSWORD'),
+                    host=os.environ.get('LPU_PGHOST', '127.0.0.1'),
+                    port=os.environ.get('LPU_PGPORT', '5432'),
+                )
+                pubsub.listen(CACHE_INVALIDATE_CHANNEL)
+                # Anything missed while disconnected is reloaded
+                self.dispatch_all()
+                for event in pubsub.events():
+                    self.dispatch(event.payload)
+            except:
+                log.error('Table listener failed', exc_info=True)
+            time.sleep(LISTEN_RETRY_DELAY)
+
+    def dispatch_all(self):
+        for callbacks in list(self.callbacks.values()):
+            for callback in callbacks:
+                callback()
+
+
+table_listener = TableListener()
+
+
+class TableCache(object):
+    # A value computed from a table, kept until the table changes or the
+    # ttl runs out. If the database is down the last value is served
+    def __init__(self, model, load: Callable, ttl: float):
+        self.table_name = f'public.{model.__tablename__}'
+        self.load = load
+        self.ttl = ttl
+        self.value = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.subscribed = False
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def is_fresh(self) -> bool:
+        return (self.loaded_at is not None
+                and time.monotonic() - self.loaded_at < self.ttl)
+
+    def get(self):
+        if not self.subscribed:
+            self.subscribed = True
+            table_listener.subscribe(self.table_name, self.invalidate)
+        if self.is_fresh():
+            return self.value
+        with self.lock:
+            if self.is_fresh():
+                return self.value
+            try:
+                self.value = self.load()
+            except Exception:
+                if self.value is None:
+                    raise
+                log.error('Serving stale cached value', exc_info=True,
+                          table_name=self.table_name)
+                return self.value
+            self.loaded_at = time.monotonic()
+            return self.value
@@ -8,18 +8,21 @@ from flask_admin import BaseView, expose
 # noinspection PyPackageRequirements
 from google.protobuf.json_format import MessageToDict
 
-from website.constants import CACHE_PATH
+from website.constants import ensure_cache_path
 from website.extensions import cache, lnd
 from website.logger import log
 
 
 class HomeView(BaseView):
+    def __caching_id__(self):
+        return self.endpoint
+
     @expose('/')
-    # @cache.memoize(timeout=600)
+    @cache.memoize(timeout=600)
     def index(self):
 
         # noinspection PyBroadException
-        info_cache_file = os.path.join(CACHE_PATH, 'info.json')
+        info_cache_file = os.path.join(ensure_cache_path(), 'info.json')
         try:
             get_info_response = lnd.rpc.get_info()
             info = MessageToDict(get_info_response)
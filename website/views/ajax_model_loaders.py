@@ -1,16 +1,158 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
 from flask_admin.model.ajax import AjaxModelLoader, DEFAULT_PAGE_SIZE
 from markupsafe import Markup
 
-from lnd_grpc.protos.rpc_pb2 import Channel
+from website.extensions import lnd
 from website.formatters.lnd import pub_key_formatter
-from website.views.lnd_model_view import LNDModelView
+from website.logger import log
+from website.views.lnd_snapshot import LNDSnapshot
+
+PeerRecord = namedtuple('PeerRecord', ['pub_key', 'alias', 'address'])
+
+# Substring matches are looked up by the trigrams of the query
+NGRAM_SIZE = 3
+
+# Aliases are looked up in the graph off the request thread, a node that is
+# not in the graph is asked again after ALIAS_MISS_TTL
+ALIAS_TTL = 24 * 60 * 60
+ALIAS_MISS_TTL = 10 * 60
+ALIAS_LOOKUP_WORKERS = 8
+
+
+def ngrams(term: str):
+    return {term[i:i + NGRAM_SIZE]
+            for i in range(len(term) - NGRAM_SIZE + 1)}
+
+
+class PeerSearchIndex(object):
+    # Built once per peer snapshot, so that autocomplete requests do not
+    # scan the peer list
+    def __init__(self, records: list):
+        self.records = sorted(records, key=lambda r: (r.alias.lower(),
+                                                      r.pub_key))
+        self.by_pk = {r.pub_key: r for r in self.records}
+        # (term, position in records), sorted for prefix lookups
+        self.terms = sorted(
+            (term, position)
+            for position, record in enumerate(self.records)
+            for term in {record.pub_key.lower(), record.alias.lower()}
+            if term
+        )
+        self.ngrams = {}
+        for term_position, (term, _) in enumerate(self.terms):
+            for ngram in ngrams(term):
+                self.ngrams.setdefault(ngram, []).append(term_position)
+
+    def prefix_matches(self, query: str):
+        i = bisect_left(self.terms, (query, -1))
+        while i < len(self.terms) and self.terms[i][0].startswith(query):
+            yield self.terms[i][1]
+            i += 1
+
+    def substring_matches(self, query: str):
+        if len(query) < NGRAM_SIZE:
+            candidates = range(len(self.terms))
+        else:
+            postings = sorted((self.ngrams.get(ngram, []) for ngram in
+                               ngrams(query)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            candidates = sorted(candidates)
+        for term_position in candidates:
+            term, position = self.terms[term_position]
+            if query in term:
+                yield position
+
+    def search(self, query: str, offset: int, limit: int) -> list:
+        query = (query or '').strip().lower()
+        if not query:
+            return self.records[offset:offset + limit]
+        # Prefix matches rank first, matching stops once the page is full
+        results = []
+        seen = set()
+        for matches in (self.prefix_matches(query),
+                        self.substring_matches(query)):
+            for position in matches:
+                if position in seen:
+                    continue
+                seen.add(position)
+                results.append(self.records[position])
+                if len(results) >= offset + limit:
+                    return results[offset:]
+        return results[offset:]
 
 
 class PeersAjaxModelLoader(AjaxModelLoader):
+    # pub_key: (alias, when to look it up again), kept between refreshes so
+    # that only new peers are looked up in the graph
+    aliases: Dict[str, Tuple[str, float]]
+
     def __init__(self, name, model, **options):
         super(PeersAjaxModelLoader, self).__init__(name, options)
 
         self.model = model
+        self.aliases = {}
+        self.aliases_lock = threading.Lock()
+        self.looking_up = False
+        self.snapshot = LNDSnapshot(
+            name='peer_search',
+            fetch=self.fetch_peers,
+            dump=lambda r: r._asdict(),
+            load=lambda rows: [PeerRecord(**r) for r in rows],
+            derive=PeerSearchIndex
+        )
+
+    @staticmethod
+    def look_up_alias(pub_key: str) -> Tuple[str, float]:
+        try:
+            alias = lnd.rpc.get_node_info(pub_key).node.alias
+        except Exception:
+            log.debug('Peer alias lookup failed', pub_key=pub_key)
+            return '', time.time() + ALIAS_MISS_TTL
+        return alias, time.time() + ALIAS_TTL
+
+    def look_up_aliases(self, pub_keys: List[str]):
+        try:
+            with ThreadPoolExecutor(max_workers=ALIAS_LOOKUP_WORKERS) as pool:
+                found = dict(zip(pub_keys,
+                                 pool.map(self.look_up_alias, pub_keys)))
+            with self.aliases_lock:
+                self.aliases.update(found)
+            # The peer list has not changed, only the aliases in it
+            self.snapshot.take(force=True)
+        except Exception:
+            log.error('Peer alias lookup failed', exc_info=True)
+        finally:
+            self.looking_up = False
+
+    def fetch_peers(self) -> list:
+        # Peers whose alias is not known yet are listed without one until
+        # the background lookup has found it
+        peers = lnd.rpc.list_peers()
+        now = time.time()
+        with self.aliases_lock:
+            pub_keys = {p.pub_key for p in peers}
+            self.aliases = {pub_key: alias
+                            for pub_key, alias in self.aliases.items()
+                            if pub_key in pub_keys}
+            missing = [pub_key for pub_key in pub_keys
+                       if self.aliases.get(pub_key, ('', 0))[1] <= now]
+            records = [PeerRecord(pub_key=p.pub_key,
+                                  alias=self.aliases.get(p.pub_key,
+                                                         ('', 0))[0],
+                                  address=p.address) for p in peers]
+            if missing and not self.looking_up:
+                self.looking_up = True
+                threading.Thread(target=self.look_up_aliases,
+                                 args=(missing,),
+                                 name='peer-aliases',
+                                 daemon=True).start()
+        return records
 
     def format(self, model):
         if model is None:
@@ -19,10 +161,7 @@ class PeersAjaxModelLoader(AjaxModelLoader):
         return model.pub_key, Markup(formatted).striptags()
 
     def get_one(self, pk):
-        return [r for r in LNDModelView(Channel).ln.get_peers()
-                if r.pub_key == pk][0]
+        return self.snapshot.get_index().by_pk.get(pk, None)
 
     def get_list(self, query, offset=0, limit=DEFAULT_PAGE_SIZE):
-        pub_keys = LNDModelView(Channel).ln.get_peers()
-        return pub_keys
-
+        return self.snapshot.get_index().search(query, offset, limit)
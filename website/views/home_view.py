@@ -1,27 +1,30 @@
 import uuid
 
-from bitcoin.core import COIN
 from flask import render_template, session, current_app
 from flask_admin import BaseView, expose
 
-from lnd_sql import session_scope
 from lnd_sql.models import ExchangeRates
 from website.constants import EXPECTED_BYTES
+from website.exchange_rate_queries import ExchangeRateQueries
 from website.forms.request_capacity_form import get_request_capacity_form
+from website.table_cache import TableCache
 from websocket.constants import MAIN_SERVER_WEBSOCKET_URL
 
 
+PRICE_PER_SAT_TTL = 60
+
+
+price_per_sat_cache = TableCache(
+    model=ExchangeRates,
+    load=ExchangeRateQueries.get_price_per_sat,
+    ttl=PRICE_PER_SAT_TTL
+)
+
+
 class HomeView(BaseView):
     @expose('/')
     def index(self):
-        with session_scope() as db_session:
-            last_price = (
-                db_session.query(ExchangeRates.last)
-                .order_by(ExchangeRates.timestamp.desc())
-                .limit(1)
-                .scalar()
-            )
-        price_per_sat = last_price / COIN
+        price_per_sat = price_per_sat_cache.get()
         form = get_request_capacity_form()
 
         if session.get('session_id', None) is None:
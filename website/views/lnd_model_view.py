@@ -1,7 +1,7 @@
 import functools
 import json
 import os
-from json import JSONDecodeError
+import threading
 
 from flask import flash
 from flask_admin.babel import gettext
@@ -10,8 +10,8 @@ from google.protobuf.json_format import MessageToDict, ParseDict
 from grpc import StatusCode
 from wtforms import Form, StringField, IntegerField, BooleanField, validators
 
-from website.constants import CACHE_PATH
 from website.extensions import lnd
+from website.views.lnd_snapshot import LNDSnapshot
 
 wtforms_type_map = {
     3: IntegerField,  # int64
@@ -50,15 +50,95 @@ def grpc_error_handling(func):
     return wrapper
 
 
+SWAGGER_FILE_PATH = os.path.abspath(os.path.join(__file__,
+                                                 '..', '..',
+                                                 'rpc.swagger.json'))
+
+
+@functools.lru_cache()
+def load_swagger() -> dict:
+    # Parsed on first use rather than when the module is imported
+    with open(SWAGGER_FILE_PATH, 'r') as swagger_file:
+        return json.load(swagger_file)
+
+
+def swagger_properties(message_name: str) -> dict:
+    return load_swagger()['definitions']['lnrpc' + message_name]['properties']
+
+
+@functools.lru_cache()
+def field_description(message_name: str, field_name: str) -> str:
+    description = swagger_properties(message_name)[field_name]
+    description = description.get('title') or description.get('description')
+    if description:
+        description = description.replace('/ ', '')
+    return description or ''
+
+
+class FieldDescription(object):
+    # Looked up when the form is rendered, not when the view is registered
+    def __init__(self, message_name: str, field_name: str):
+        self.message_name = message_name
+        self.field_name = field_name
+
+    def __str__(self):
+        return field_description(self.message_name, self.field_name)
+
+    def __bool__(self):
+        return bool(str(self))
+
+
+@functools.lru_cache()
+def column_descriptions(message_name: str) -> dict:
+    return {
+        c: p.get('title', '').replace('/ ', '')
+        for c, p in swagger_properties(message_name).items()
+    }
+
+
+class SnapshotIndex(object):
+    # Built once per snapshot, so that list pages only slice and detail
+    # views are a dict lookup
+    def __init__(self, records: list, model, primary_key: str):
+        self.records = records
+        self.by_pk = {str(getattr(r, primary_key)): r for r in records}
+        default_order = list(records)
+        if hasattr(model(), 'capacity'):
+            default_order.sort(key=lambda x: getattr(x, 'capacity'),
+                               reverse=True)
+        if hasattr(model(), 'active'):
+            default_order.sort(key=lambda x: getattr(x, 'active'),
+                               reverse=True)
+        self.default_order = default_order
+        self.orders = {}
+        self.lock = threading.Lock()
+
+    def sorted_by(self, sort_field: str = None, sort_desc: bool = False):
+        if sort_field is None:
+            return self.default_order
+        key = (sort_field, sort_desc)
+        order = self.orders.get(key, None)
+        if order is None:
+            with self.lock:
+                order = self.orders.get(key, None)
+                if order is None:
+                    order = sorted(self.default_order,
+                                   key=lambda x: getattr(x, sort_field),
+                                   reverse=sort_desc)
+                    self.orders[key] = order
+        return order
+
+
 class LNDModelView(BaseModelView):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-
-    swagger_file_path = os.path.abspath(os.path.join(__file__,
-                                                     '..', '..',
-                                                     'rpc.swagger.json'))
-    with open(swagger_file_path, 'r') as swagger_file:
-        swagger = json.load(swagger_file)
+        self.snapshot = LNDSnapshot(
+            name=self.get_query,
+            fetch=self.fetch_records,
+            dump=MessageToDict,
+            load=self.load_records,
+            derive=self.build_index
+        )
 
     create_form_class = None
     get_query = None
@@ -74,46 +154,56 @@ class LNDModelView(BaseModelView):
     list_template = 'admin/lnd_list.html'
 
     def get_one(self, record_id):
-        record_count, records = self.get_list()
-        return [r for r in records
-                if str(getattr(r, self.primary_key)) == str(record_id)][0]
+        return self.get_index().by_pk.get(str(record_id), None)
 
     def get_pk_value(self, model):
         return getattr(model, self.primary_key)
 
-    def get_list(self, page=None, sort_field=None, sort_desc=False, search=None,
-                 filters=None, page_size=None):
-        cache_file = os.path.join(CACHE_PATH, self.get_query + '.json')
+    @staticmethod
+    def visible_records(records: list) -> list:
+        # Applied to records from LND and from the snapshot file alike, so
+        # every worker shows the same ones
+        records = [r for r in records if not getattr(r, 'private', False)]
+        for record in records:
+            if 'pending_htlcs' in record.DESCRIPTOR.fields_by_name:
+                record.ClearField('pending_htlcs')
+        return records
+
+    def fetch_records(self) -> list:
+        return self.visible_records(list(getattr(lnd, self.get_query)()))
+
+    def load_records(self, rows: list) -> list:
+        for row in rows:
+            row.pop('pending_htlcs', None)
+            row.pop('pendingHtlcs', None)
+        return self.visible_records([ParseDict(m, self.model())
+                                     for m in rows])
+
+    def build_index(self, records: list) -> SnapshotIndex:
+        index = SnapshotIndex(records, model=self.model,
+                              primary_key=self.primary_key)
+        sort_field = self.column_default_sort
+        if isinstance(sort_field, tuple):
+            index.sorted_by(*sort_field)
+        elif sort_field is not None:
+            index.sorted_by(sort_field)
+        return index
 
-        try:
-            results = getattr(lnd, self.get_query)()
-            with open(cache_file, 'w') as f:
-                json.dump([MessageToDict(m) for m in results], f)
-        except Exception as e:
-            # todo add error logging
-            print(e)
-            try:
-                with open(cache_file, 'r') as f:
-                    results = json.load(f)
-                    results = [r for r in results if not r.get('private', False)]
-                    [r.pop('pending_htlcs', None) for r in results]
-                    results = [ParseDict(m, self.model()) for m in results]
-            except (FileNotFoundError, JSONDecodeError):
-                results = []
+    def get_index(self) -> SnapshotIndex:
+        return self.snapshot.get_index()
 
+    def get_list(self, page=None, sort_field=None, sort_desc=False, search=None,
+                 filters=None, page_size=None):
         sort_field = sort_field or self.column_default_sort
         if isinstance(sort_field, tuple):
             sort_field, sort_desc = sort_field
-        if hasattr(self.model(), 'capacity'):
-            results.sort(key=lambda x: getattr(x, 'capacity'),
-                         reverse=True)
-        if hasattr(self.model(), 'active'):
-            results.sort(key=lambda x: getattr(x, 'active'),
-                         reverse=True)
-        if sort_field is not None:
-            results.sort(key=lambda x: getattr(x, sort_field),
-                         reverse=sort_desc)
+        results = self.get_index().sorted_by(sort_field, bool(sort_desc))
 
+        if page_size is None:
+            page_size = self.page_size
+        if page_size:
+            start = (page or 0) * page_size
+            return len(results), results[start:start + page_size]
         return len(results), results
 
     def create_model(self, form):
@@ -144,13 +234,8 @@ class LNDModelView(BaseModelView):
 
             # noinspection PyPep8Naming
             FormClass = wtforms_type_map[field_type]
-            description = self.swagger['definitions'][
-                'lnrpc' + self.create_form_class.__name__]['properties'][
-                field.name]
-            description = description.get('title') or description.get(
-                'description')
-            if description:
-                description = description.replace('/ ', '')
+            description = FieldDescription(self.create_form_class.__name__,
+                                           field.name)
             form_field = FormClass(field.name,
                                    default=field.default_value or None,
                                    description=description,
@@ -169,12 +254,13 @@ class LNDModelView(BaseModelView):
 
     def scaffold_sortable_columns(self):
         columns = [field.name for field in self.model.DESCRIPTOR.fields]
-        self.column_descriptions = {
-            c: self.swagger['definitions'][
-                'lnrpc' + self.model.__name__]['properties'][c].get('title', '').replace('/ ', '')
-            for c in columns
-        }
         return columns
 
+    @property
+    def column_descriptions(self):
+        # Only the list template reads these, so the swagger definitions
+        # are not parsed while the view is being registered
+        return column_descriptions(self.model.__name__)
+
     def _create_ajax_loader(self, name, options):
         pass
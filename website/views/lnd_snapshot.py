@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from json import JSONDecodeError
+from typing import Callable, Optional
+
+from website.constants import CACHE_PATH, ensure_cache_path
+from website.logger import log
+
+# Older snapshots are still served, but trigger a refresh from LND
+SNAPSHOT_TTL = 60
+
+
+class LNDSnapshot(object):
+    # The last result of an LND call, kept in memory and in CACHE_PATH so
+    # that requests never wait on LND once any worker has taken one
+    def __init__(self, name: str, fetch: Callable, dump: Callable,
+                 load: Callable, derive: Optional[Callable] = None,
+                 ttl: float = SNAPSHOT_TTL):
+        self.name = name
+        self.fetch = fetch
+        self.dump = dump
+        self.load = load
+        self.derive = derive
+        self.ttl = ttl
+        self.records = None
+        self.taken_at = None
+        self.index = None
+        self.refresh_lock = threading.Lock()
+        self.refreshing = False
+
+    @property
+    def cache_file(self):
+        return os.path.join(CACHE_PATH, self.name + '.json')
+
+    def read_file(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                rows = json.load(f)
+            taken_at = os.path.getmtime(self.cache_file)
+        except (FileNotFoundError, JSONDecodeError):
+            return None, None
+        return self.load(rows), taken_at
+
+    def write_file(self, records: list):
+        # Written next to the snapshot and renamed over it, so readers in
+        # other workers never see a partial file
+        fd, temporary_path = tempfile.mkstemp(dir=ensure_cache_path(),
+                                              prefix=self.name,
+                                              suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump([self.dump(r) for r in records], f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.cache_file)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def is_fresh(self, taken_at) -> bool:
+        return taken_at is not None and time.time() - taken_at < self.ttl
+
+    def publish(self, records: list, taken_at: float):
+        # Derived before it is published, so requests do not pay for it
+        if self.derive is not None:
+            self.index = self.derive(records)
+        self.records, self.taken_at = records, taken_at
+
+    def take(self, force: bool = False):
+        # Another worker may have refreshed the file already, unless the
+        # caller knows that LND's answer has changed
+        records, taken_at = (None, None) if force else self.read_file()
+        if not self.is_fresh(taken_at):
+            records = list(self.fetch())
+            taken_at = time.time()
+            self.write_file(records)
+        self.publish(records, taken_at)
+
+    def refresh(self):
+        try:
+            self.take()
+        except Exception:
+            log.error('LND snapshot refresh failed', exc_info=True,
+                      snapshot=self.name)
+        finally:
+            self.refreshing = False
+
+    def refresh_in_background(self):
+        with self.refresh_lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh,
+                         name=f'snapshot-{self.name}',
+                         daemon=True).start()
+
+    def get(self) -> list:
+        if self.records is None:
+            records, taken_at = self.read_file()
+            if records is not None:
+                self.publish(records, taken_at)
+        if self.records is None:
+            # Only the very first request waits on LND
+            try:
+                self.take()
+            except Exception:
+                log.error('LND snapshot failed', exc_info=True,
+                          snapshot=self.name)
+                self.publish([], None)
+                return self.records
+        if not self.is_fresh(self.taken_at):
+            self.refresh_in_background()
+        return self.records
+
+    def get_index(self):
+        self.get()
+        return self.index
@@ -0,0 +1,121 @@
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from lnd_grpc.lnd_grpc import Client
+
+from websocket.executors import rpc_executor
+from websocket.metrics import track_phase
+
+_END_OF_STREAM = object()
+
+# How often a drain thread blocked on a full queue checks whether the
+# consumer has gone away
+PUT_POLL_INTERVAL = 1
+
+
+class AsyncClient(object):
+    client: Client
+
+    def __init__(self, client: Client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_event_loop()
+            with track_phase('rpc'):
+                return await loop.run_in_executor(
+                    rpc_executor,
+                    functools.partial(method, *args, **kwargs)
+                )
+
+        return wrapper
+
+    async def call_future(self, stub_method, request, timeout=None):
+        # Unary call through the gRPC future API, so it holds no pool thread
+        # and cancelling the awaiting task cancels the call in gRPC
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        call = stub_method.future(request, timeout=timeout)
+
+        def resolve(done_call):
+            if waiter.done():
+                return
+            if done_call.cancelled():
+                waiter.cancel()
+            elif done_call.exception() is not None:
+                waiter.set_exception(done_call.exception())
+            else:
+                waiter.set_result(done_call.result())
+
+        def on_done(done_call):
+            try:
+                loop.call_soon_threadsafe(resolve, done_call)
+            except RuntimeError:
+                # The event loop has been closed
+                pass
+
+        call.add_done_callback(on_done)
+        try:
+            with track_phase('rpc'):
+                return await waiter
+        finally:
+            if not call.done():
+                call.cancel()
+
+    async def stream(self, name: str, *args, max_pending: int = 0,
+                     **kwargs):
+        # Server-streaming responses are drained on their own thread so that
+        # long-lived subscriptions do not pin a worker of the RPC pool.
+        # With max_pending the thread blocks once that many updates are
+        # waiting, which leaves the rest to gRPC flow control
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=max_pending)
+        response = await getattr(self, name)(*args, **kwargs)
+        stopped = threading.Event()
+
+        def put(item) -> bool:
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put(item),
+                                                          loop)
+            except RuntimeError:
+                # The event loop has been closed
+                return False
+            while not stopped.is_set():
+                try:
+                    future.result(timeout=PUT_POLL_INTERVAL)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    continue
+            future.cancel()
+            return False
+
+        def drain():
+            try:
+                for update in response:
+                    if not put(update):
+                        return
+            except Exception as exc:
+                put(exc)
+            put(_END_OF_STREAM)
+
+        threading.Thread(target=drain, name=f'stream-{name}',
+                         daemon=True).start()
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END_OF_STREAM:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            if hasattr(response, 'cancel'):
+                response.cancel()
@@ -0,0 +1,142 @@
+import asyncio
+from datetime import timedelta
+from typing import Callable
+
+# noinspection PyProtectedMember
+from grpc._channel import _Rendezvous
+
+from website.logger import log
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import ChannelOpenJobQueries
+from websocket.queries.channel_open_job_queries import (
+    DONE,
+    FAILED,
+    QUEUED,
+    utcnow
+)
+
+OPEN_CONCURRENCY = 4
+POLL_INTERVAL = 5
+STATS_INTERVAL = 15
+
+MAX_ATTEMPTS = 8
+INITIAL_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 30 * 60
+
+# LND errors that retrying will not fix, anything else is retried
+PERMANENT_ERRORS = (
+    'below min chan size',
+    'exceeds maximum chan size',
+    'cannot open channel to self',
+    'invalid'
+)
+
+
+def error_details(error: Exception) -> str:
+    if isinstance(error, _Rendezvous):
+        return error.details()
+    return str(error) or error.__class__.__name__
+
+
+def is_permanent(details: str) -> bool:
+    return any(e in details for e in PERMANENT_ERRORS)
+
+
+def retry_delay(attempts: int) -> float:
+    return min(INITIAL_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+class ChannelOpenQueue(object):
+    def __init__(self, handler: Callable, on_failed: Callable,
+                 concurrency: int = OPEN_CONCURRENCY):
+        self.handler = handler
+        self.on_failed = on_failed
+        self.concurrency = concurrency
+        self.wakeup = None
+        self.tasks = []
+        self.depth = None
+        self.oldest = None
+        metrics.register_gauge('channel_open_queue_depth',
+                               lambda: self.depth)
+        metrics.register_gauge('channel_open_queue_age', self.age)
+
+    def age(self):
+        if self.oldest is None:
+            return None
+        return (utcnow() - self.oldest).total_seconds()
+
+    def wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def start(self):
+        if self.tasks:
+            return
+        await run_query(ChannelOpenJobQueries.create_table)
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.ensure_future(self.work())
+                      for _ in range(self.concurrency)]
+        self.tasks.append(asyncio.ensure_future(self.refresh_stats()))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def work(self):
+        while True:
+            try:
+                job = await run_query(ChannelOpenJobQueries.claim)
+            except Exception:
+                log.error('Error claiming channel open job', exc_info=True)
+                job = None
+            if job is None:
+                await self.wait()
+                continue
+            # A job left running when recording its outcome fails is
+            # claimed again once its lease runs out
+            try:
+                await self.run_job(job)
+            except Exception:
+                log.error('Error running channel open job', job_id=job['id'],
+                          exc_info=True)
+
+    async def run_job(self, job: dict):
+        try:
+            await self.handler(job)
+        except Exception as error:
+            details = error_details(error)
+            if is_permanent(details) or job['attempts'] >= MAX_ATTEMPTS:
+                log.error('Channel open job failed', job_id=job['id'],
+                          attempts=job['attempts'], error=details)
+                await run_query(ChannelOpenJobQueries.finish, job['id'],
+                                FAILED, error=details)
+                await self.on_failed(job, details)
+                return
+            delay = retry_delay(job['attempts'])
+            log.info('Retrying channel open job', job_id=job['id'],
+                     attempts=job['attempts'], delay=delay, error=details)
+            await run_query(ChannelOpenJobQueries.finish, job['id'], QUEUED,
+                            error=details,
+                            run_after=utcnow() + timedelta(seconds=delay))
+            return
+        await run_query(ChannelOpenJobQueries.finish, job['id'], DONE)
+
+    async def refresh_stats(self):
+        while True:
+            try:
+                stats = await run_query(ChannelOpenJobQueries.get_stats)
+                self.depth = stats['depth']
+                self.oldest = stats['oldest']
+            except Exception:
+                log.error('Error reading channel open queue stats',
+                          exc_info=True)
+            await asyncio.sleep(STATS_INTERVAL)
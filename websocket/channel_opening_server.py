@@ -1,21 +1,28 @@
 import binascii
+import functools
 import json
 
-import aiohttp
 from aiohttp import web, WSMsgType
 from aiohttp.web_request import Request
 # noinspection PyPackageRequirements
 from google.protobuf.json_format import MessageToDict
-# noinspection PyProtectedMember
-from grpc._channel import _Rendezvous
 from lnd_grpc.lnd_grpc import Client
 
 from website.logger import log
+from websocket.async_client import AsyncClient
+from websocket.channel_open_queue import OPEN_CONCURRENCY, ChannelOpenQueue
 from websocket.constants import (
     MAIN_SERVER_WEBSOCKET_URL,
     INVOICES_SERVER_ID,
     CHANNELS_SERVER_ID
 )
+from websocket.internal_link import (
+    InternalLink,
+    RecentMessageIds,
+    handle_once
+)
+from websocket.metrics import metrics
+from websocket.utxo_reservations import UtxoReservations
 
 
 class ChannelOpeningServer(web.View):
@@ -46,7 +53,7 @@ class ChannelOpeningServer(web.View):
                     exc_info=True,
                     msgdata=msg.data
                 )
-                return
+                continue
 
             if data.get('server_id', None) != INVOICES_SERVER_ID:
                 log.error(
@@ -56,45 +63,122 @@ class ChannelOpeningServer(web.View):
                 )
                 return
 
-            log.debug('Opening channel', data=data)
-            open_channel_response = self.request.app['grpc'].open_channel(
-                node_pubkey_string=data['remote_pubkey'],
-                local_funding_amount=int(data['local_funding_amount']),
-                push_sat=0,
-                sat_per_byte=int(data['sat_per_byte']),
-                spend_unconfirmed=True
+            # The job row is the source of truth, messages only save the
+            # workers a poll
+            await handle_once(
+                websocket=websocket,
+                data=data,
+                recent=self.request.app['recent_message_ids'],
+                handle=self.wake_jobs
             )
 
-            try:
-                for update in open_channel_response:
-                    update_data = MessageToDict(update)
-                    if not update_data.get('chan_pending', None):
-                        continue
-                    txid_bytes = update.chan_pending.txid
-                    txid_str = binascii.hexlify(txid_bytes[::-1]).decode('utf8')
-                    update_data['chan_pending']['txid'] = txid_str
-                    msg = {
-                        'server_id': CHANNELS_SERVER_ID,
-                        'session_id': data['session_id'],
-                        'open_channel_update': update_data
-                    }
-                    async with aiohttp.ClientSession() as session:
-                        async with session.ws_connect(
-                                MAIN_SERVER_WEBSOCKET_URL) as m_ws:
-                            await m_ws.send_str(json.dumps(msg))
-                    break
-            except _Rendezvous as e:
-                error_details = e.details()
-                error_message = {
-                    'server_id': CHANNELS_SERVER_ID,
-                    'session_id': data['session_id'],
-                    'error': error_details
-                }
-                log.error('Open channel error', error_message=error_message)
-                async with aiohttp.ClientSession() as session:
-                    async with session.ws_connect(
-                            MAIN_SERVER_WEBSOCKET_URL) as m_ws:
-                        await m_ws.send_str(json.dumps(error_message))
+    async def wake_jobs(self):
+        self.request.app['jobs'].wake()
+
+
+def send_channel_pending(app: web.Application, session_id: str,
+                         update_data: dict):
+    app['main_link'].send({
+        'server_id': CHANNELS_SERVER_ID,
+        'session_id': session_id,
+        'open_channel_update': update_data
+    })
+
+
+async def open_channel(app: web.Application, data: dict):
+    log.debug('Opening channel', data=data)
+    open_channel_response = app['grpc'].stream(
+        'open_channel',
+        node_pubkey_string=data['remote_pubkey'],
+        local_funding_amount=int(data['local_funding_amount']),
+        push_sat=0,
+        sat_per_byte=int(data['sat_per_byte']),
+        spend_unconfirmed=True
+    )
+    async for update in open_channel_response:
+        update_data = MessageToDict(update)
+        if not update_data.get('chan_pending', None):
+            continue
+        txid_bytes = update.chan_pending.txid
+        txid_str = binascii.hexlify(txid_bytes[::-1]).decode('utf8')
+        update_data['chan_pending']['txid'] = txid_str
+        send_channel_pending(app, data['session_id'], update_data)
+        return
+    raise RuntimeError('Open channel stream ended before the channel was '
+                       'pending')
+
+
+async def find_pending_open(app: web.Application, job: dict) -> bool:
+    # A retried job may have been opened by an attempt that died before
+    # recording it, LND's pending channels tell
+    pending_channels = await app['grpc'].pending_channels()
+    for pending in pending_channels.pending_open_channels:
+        channel = pending.channel
+        if channel.remote_node_pub != job['remote_pubkey']:
+            continue
+        if channel.capacity != int(job['local_funding_amount']):
+            continue
+        txid, output_index = channel.channel_point.split(':')
+        send_channel_pending(app, job['session_id'], {
+            'chan_pending': {'txid': txid, 'output_index': int(output_index)}
+        })
+        return True
+    return False
+
+
+async def open_job(app: web.Application, job: dict):
+    if job['attempts'] > 1 and await find_pending_open(app, job):
+        return
+    # The OpenChannelRequest of the pinned lnd_grpc cannot name its inputs,
+    # so LND still picks the outputs. The reservation is advisory, it keeps
+    # concurrent opens from committing more than the wallet holds
+    await app['utxos'].reserve(
+        key=job['r_hash'],
+        amount=int(job['local_funding_amount']),
+        sat_per_byte=int(job['sat_per_byte'])
+    )
+    try:
+        await open_channel(app, job)
+    except Exception:
+        app['utxos'].release(job['r_hash'], spent=False)
+        raise
+    app['utxos'].release(job['r_hash'], spent=True)
+
+
+async def send_open_error(app: web.Application, job: dict, details: str):
+    error_message = {
+        'server_id': CHANNELS_SERVER_ID,
+        'session_id': job['session_id'],
+        'error': details
+    }
+    log.error('Open channel error', error_message=error_message)
+    app['main_link'].send(error_message)
+
+
+class StatsView(web.View):
+    async def get(self):
+        return web.json_response(metrics.to_dict())
+
+
+async def start_main_link(app: web.Application):
+    app['main_link'] = InternalLink(MAIN_SERVER_WEBSOCKET_URL, name='main')
+    app['main_link'].start()
+
+
+async def start_jobs(app: web.Application):
+    app['utxos'] = UtxoReservations(app['grpc'])
+    app['utxos'].start()
+    app['jobs'] = ChannelOpenQueue(
+        handler=functools.partial(open_job, app),
+        on_failed=functools.partial(send_open_error, app),
+        concurrency=app['concurrency']
+    )
+    await app['jobs'].start()
+
+
+async def close_main_link(app: web.Application):
+    await app['jobs'].close()
+    await app['main_link'].close()
 
 
 if __name__ == '__main__':
@@ -132,16 +216,32 @@ if __name__ == '__main__':
         default='127.0.0.1'
     )
 
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='Channel open jobs run at the same time',
+        default=OPEN_CONCURRENCY
+    )
+
     args = parser.parse_args()
 
     app = web.Application()
-    app['grpc'] = Client(
+    app['grpc'] = AsyncClient(Client(
         grpc_host=args.host,
         grpc_port=args.port,
         macaroon_path=args.macaroon,
         tls_cert_path=args.tls
-    )
-
-    app.add_routes([web.get('/', ChannelOpeningServer)])
+    ))
+
+    app['recent_message_ids'] = RecentMessageIds()
+    app['concurrency'] = args.concurrency
+    app.on_startup.append(start_main_link)
+    app.on_startup.append(start_jobs)
+    app.on_cleanup.append(close_main_link)
+
+    app.add_routes([
+        web.get('/', ChannelOpeningServer),
+        web.get('/stats', StatsView)
+    ])
 
     web.run_app(app, host='localhost', port=8710)
@@ -1,3 +1,5 @@
+import functools
+
 from websocket.utilities import get_server_id
 
 MAIN_SERVER_WEBSOCKET_URL = 'wss://lightningpowerusers.com:8765'
@@ -6,5 +8,23 @@ CHANNEL_OPENING_SERVER_WEBSOCKET_URL = 'ws://localhost:8710'
 
 PUBKEY_LENGTH = 66
 
-INVOICES_SERVER_ID = get_server_id('invoices')
-CHANNELS_SERVER_ID = get_server_id('channels')
+CAPACITY_REQUEST_MEMO = 'Lightning Power Users capacity request: '
+
+# Module attribute: the server it names in the keyring
+SERVER_IDS = {
+    'INVOICES_SERVER_ID': 'invoices',
+    'CHANNELS_SERVER_ID': 'channels'
+}
+
+
+@functools.lru_cache()
+def get_cached_server_id(server_name: str) -> str:
+    return get_server_id(server_name)
+
+
+def __getattr__(name):
+    # Reading a server id opens the keyring, so it happens when a server
+    # imports the id rather than whenever this module is imported
+    if name in SERVER_IDS:
+        return get_cached_server_id(SERVER_IDS[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
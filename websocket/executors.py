@@ -0,0 +1,32 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from websocket.metrics import track_phase
+
+# Keep this at or below the SQLAlchemy pool size (pool_size + max_overflow)
+# so that every database thread can check out a connection without waiting
+DATABASE_POOL_SIZE = 10
+
+database_executor = ThreadPoolExecutor(
+    max_workers=DATABASE_POOL_SIZE,
+    thread_name_prefix='database'
+)
+
+# Blocking LND calls such as connect can hold a thread for their whole
+# timeout, so this pool is separate from the database one
+RPC_POOL_SIZE = 20
+
+rpc_executor = ThreadPoolExecutor(
+    max_workers=RPC_POOL_SIZE,
+    thread_name_prefix='rpc'
+)
+
+
+async def run_query(query, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    with track_phase('db'):
+        return await loop.run_in_executor(
+            database_executor,
+            functools.partial(query, *args, **kwargs)
+        )
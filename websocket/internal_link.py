@@ -0,0 +1,171 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict
+
+import aiohttp
+from aiohttp import WSMsgType
+
+from website.logger import log
+
+HEARTBEAT_INTERVAL = 15
+INITIAL_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+RECENT_MESSAGE_IDS = 10000
+
+# Messages the other side has not acknowledged by then are sent again, it
+# only acknowledges a message once it has been handled
+RESEND_INTERVAL = 30
+
+
+class InternalLink(object):
+    pending: OrderedDict
+    queue: asyncio.Queue
+    # message_id: when it was last written to the websocket
+    sent_at: Dict[str, float]
+
+    def __init__(self, url: str, name: str):
+        self.url = url
+        self.name = name
+        self.pending = OrderedDict()
+        self.sent_at = {}
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def send(self, message: dict) -> asyncio.Future:
+        # Messages stay pending until the other side acknowledges them, so
+        # they are sent again if the connection drops before the ack arrives
+        message_id = uuid.uuid4().hex
+        message['message_id'] = message_id
+        delivered = asyncio.get_event_loop().create_future()
+        self.pending[message_id] = (message, delivered)
+        self.queue.put_nowait(message_id)
+        self.start()
+        return delivered
+
+    def acknowledge(self, message_id: str):
+        message, delivered = self.pending.pop(message_id, (None, None))
+        self.sent_at.pop(message_id, None)
+        if delivered is not None and not delivered.done():
+            delivered.set_result(message_id)
+
+    async def write(self, ws: aiohttp.ClientWebSocketResponse):
+        while True:
+            message_id = await self.queue.get()
+            if message_id not in self.pending:
+                continue
+            message, _ = self.pending[message_id]
+            await ws.send_str(json.dumps(message))
+            self.sent_at[message_id] = time.monotonic()
+
+    async def resend(self):
+        while True:
+            await asyncio.sleep(RESEND_INTERVAL)
+            cutoff = time.monotonic() - RESEND_INTERVAL
+            for message_id in list(self.pending):
+                if self.sent_at.get(message_id, cutoff) <= cutoff:
+                    self.sent_at.pop(message_id, None)
+                    self.queue.put_nowait(message_id)
+
+    async def read(self, ws: aiohttp.ClientWebSocketResponse):
+        async for msg in ws:
+            if msg.type != WSMsgType.text:
+                break
+            # noinspection PyBroadException
+            try:
+                data = json.loads(msg.data)
+            except:
+                log.error('Error loading json', exc_info=True,
+                          link=self.name, msgdata=msg.data)
+                continue
+            if data.get('action', None) == 'ack':
+                self.acknowledge(data.get('message_id', None))
+
+    async def supervise(self, ws: aiohttp.ClientWebSocketResponse):
+        # If any of them stops, the connection is dropped and made again,
+        # which also restarts a writer that died
+        tasks = [asyncio.ensure_future(self.read(ws)),
+                 asyncio.ensure_future(self.write(ws)),
+                 asyncio.ensure_future(self.resend())]
+        try:
+            done, _ = await asyncio.wait(tasks,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                log.error('Internal link task failed', link=self.name,
+                          exc_info=task.exception())
+
+    async def run(self):
+        retry_delay = INITIAL_RETRY_DELAY
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(
+                            self.url,
+                            heartbeat=HEARTBEAT_INTERVAL) as ws:
+                        log.debug('Internal link connected', link=self.name,
+                                  pending=len(self.pending))
+                        retry_delay = INITIAL_RETRY_DELAY
+                        self.queue = asyncio.Queue()
+                        self.sent_at = {}
+                        for message_id in self.pending:
+                            self.queue.put_nowait(message_id)
+                        await self.supervise(ws)
+                except (aiohttp.ClientError, OSError, asyncio.TimeoutError):
+                    log.error('Internal link error', link=self.name,
+                              exc_info=True)
+                log.debug('Internal link disconnected', link=self.name,
+                          retry_delay=retry_delay)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+
+class RecentMessageIds(object):
+    def __init__(self, size: int = RECENT_MESSAGE_IDS):
+        self.ids = set()
+        self.order = deque()
+        self.size = size
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self.ids
+
+    def add(self, message_id: str):
+        if message_id in self.ids:
+            return
+        self.ids.add(message_id)
+        self.order.append(message_id)
+        if len(self.order) > self.size:
+            self.ids.discard(self.order.popleft())
+
+
+async def handle_once(websocket, data: dict, recent: RecentMessageIds,
+                      handle: Callable[[], Awaitable]):
+    # A message is acknowledged only after it was handled, so one that
+    # fails stays pending on the sender and is sent again. Messages that
+    # were already handled are acknowledged without handling them twice
+    message_id = data.get('message_id', None)
+    if message_id is None or message_id not in recent:
+        await handle()
+        if message_id is not None:
+            recent.add(message_id)
+    if message_id is not None:
+        await websocket.send_json({'action': 'ack', 'message_id': message_id})
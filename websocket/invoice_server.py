@@ -1,43 +1,94 @@
 import asyncio
-import json
 import signal
+from typing import Set
 
-import aiohttp
 from google.protobuf.json_format import MessageToDict
 
-
 from lnd_grpc.lnd_grpc import Client
 from lnd_sql.scripts.upsert_invoices import UpsertInvoices
 from website.logger import log
+from websocket.async_client import AsyncClient
 from websocket.constants import (
+    CAPACITY_REQUEST_MEMO,
     CHANNEL_OPENING_SERVER_WEBSOCKET_URL,
+    INVOICES_SERVER_ID,
     MAIN_SERVER_WEBSOCKET_URL
 )
-from websocket.queries import InboundCapacityRequestQueries
-from websocket.utilities import get_server_id
+from websocket.executors import run_query
+from websocket.internal_link import InternalLink
+from websocket.queries import (
+    ChannelOpenJobQueries,
+    InboundCapacityRequestQueries,
+    InvoiceQueries
+)
+from websocket.unpaid_invoice_index import UnpaidInvoiceIndex
+from websocket.worker_pool import KeyedWorkerPool
+
+INVOICE_WORKERS = 8
+
+# Settled invoices waiting per worker before the subscription is held back
+MAX_PENDING_INVOICES = 64
+
+CATCH_UP_PAGE_SIZE = 1000
+
+# How often the handled settle index is written for the next catch-up
+CURSOR_FLUSH_INTERVAL = 1
 
 
 class InvoiceServer(object):
-    def __init__(self, rpc: Client):
+    # Settle indexes submitted above the contiguous settle_index watermark
+    settled_above: Set[int]
+    # Settle indexes handled above the contiguous handled_settle_index
+    handled_above: Set[int]
+
+    def __init__(self, rpc: AsyncClient):
         self.rpc = rpc
+        self.main_link = InternalLink(MAIN_SERVER_WEBSOCKET_URL, name='main')
+        self.channel_opening_link = InternalLink(
+            CHANNEL_OPENING_SERVER_WEBSOCKET_URL,
+            name='channel_opening'
+        )
+        self.local_pubkey = None
+        self.unpaid_invoices = UnpaidInvoiceIndex()
+        self.add_index = 0
+        self.settle_index = 0
+        self.settled_above = set()
+        self.handled_settle_index = 0
+        self.handled_above = set()
+        self.flushed_settle_index = 0
+        # Settled invoices up to here were written by the catch-up COPY
+        self.bulk_loaded_settle_index = 0
+        self.workers = KeyedWorkerPool(
+            handler=self.handle_settled,
+            workers=INVOICE_WORKERS,
+            max_pending=MAX_PENDING_INVOICES
+        )
 
-    @staticmethod
-    async def handle_invoice(local_pubkey, invoice):
-        # Invoices that are being added, not settled
-        if not invoice.settle_date:
-            return
+    async def handle_invoice(self, invoice):
+        if invoice.settle_index > self.bulk_loaded_settle_index:
+            await run_query(
+                UpsertInvoices.upsert,
+                single_invoice=invoice,
+                local_pubkey=self.local_pubkey
+            )
 
-        UpsertInvoices.upsert(
-            single_invoice=invoice,
-            local_pubkey=local_pubkey
-        )
+        r_hash = invoice.r_hash.hex()
+        capacity_request = self.unpaid_invoices.pop(r_hash)
+        if capacity_request is None:
+            if not invoice.memo.startswith(CAPACITY_REQUEST_MEMO):
+                log.info('Invoice not related to capacity request',
+                         r_hash=r_hash, memo=invoice.memo)
+                return
+            # Paid before the index picked it up
+            capacity_request = await run_query(
+                InboundCapacityRequestQueries.get_by_invoice,
+                r_hash
+            )
 
         invoice_data = MessageToDict(invoice)
-        invoice_data['r_hash'] = r_hash = invoice.r_hash.hex()
+        invoice_data['r_hash'] = r_hash
         invoice_data['r_preimage'] = invoice.r_preimage.hex()
 
-        capacity_request = InboundCapacityRequestQueries.get_by_invoice(r_hash)
-
         if capacity_request is None:
             log.info('Invoice not related to capacity request',
                      invoice_data=invoice_data)
@@ -49,44 +100,141 @@ class InvoiceServer(object):
                       total_fee=capacity_request['total_fee'])
             return
 
+        # Queued before the session hears about the payment so that a
+        # restart of either server cannot lose the open
+        await run_query(
+            ChannelOpenJobQueries.enqueue,
+            r_hash=r_hash,
+            session_id=capacity_request['session_id'],
+            remote_pubkey=capacity_request['remote_pubkey'],
+            local_funding_amount=capacity_request['capacity'],
+            sat_per_byte=capacity_request['transaction_fee_rate']
+        )
+        log.debug('queued channel open', r_hash=r_hash,
+                  session_id=capacity_request['session_id'])
+        self.channel_opening_link.send(dict(
+            server_id=INVOICES_SERVER_ID,
+            session_id=capacity_request['session_id'],
+            type='open_channel'
+        ))
+
         client_invoice_data = {
-            'server_id': get_server_id('invoices'),
+            'server_id': INVOICES_SERVER_ID,
             'invoice_data': invoice_data,
             'session_id': capacity_request['session_id']
         }
         log.debug('sending paid invoice',
                   client_invoice_data=client_invoice_data)
-        client_invoice_data_string = json.dumps(client_invoice_data)
+        self.main_link.send(client_invoice_data)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(MAIN_SERVER_WEBSOCKET_URL) as ws:
-                await ws.send_str(client_invoice_data_string)
-                await ws.close()
+    async def handle_settled(self, invoice):
+        await self.handle_invoice(invoice)
+        self.mark_handled(invoice.settle_index)
 
-        chan_open_data = dict(
-            server_id=get_server_id('invoices'),
-            session_id=capacity_request['session_id'],
-            type='open_channel',
-            remote_pubkey=capacity_request['remote_pubkey'],
-            local_funding_amount=capacity_request['capacity'],
-            sat_per_byte=capacity_request['transaction_fee_rate']
-        )
-        log.debug('sending channel open instructions',
-                  chan_open_data=chan_open_data)
-        chan_open_data_string = json.dumps(chan_open_data)
+    def mark_handled(self, settle_index: int):
+        # Workers finish out of order, a restart resumes at the first
+        # settle index that was not handled
+        self.handled_above.add(settle_index)
+        while self.handled_settle_index + 1 in self.handled_above:
+            self.handled_settle_index += 1
+            self.handled_above.remove(self.handled_settle_index)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(CHANNEL_OPENING_SERVER_WEBSOCKET_URL) as ws:
-                await ws.send_str(chan_open_data_string)
-                await ws.close()
+    async def flush_cursor(self):
+        while True:
+            await asyncio.sleep(CURSOR_FLUSH_INTERVAL)
+            settle_index = self.handled_settle_index
+            if settle_index == self.flushed_settle_index:
+                continue
+            try:
+                await run_query(InvoiceQueries.set_handled_settle_index,
+                                settle_index)
+            except Exception:
+                log.error('Failed to record handled settle index',
+                          exc_info=True, settle_index=settle_index)
+                continue
+            self.flushed_settle_index = settle_index
+
+    def mark_settled(self, settle_index: int) -> bool:
+        # LND replays settled invoices from both the add and the settle
+        # backlog, each settle index is handled once
+        if settle_index <= self.settle_index:
+            return False
+        if settle_index in self.settled_above:
+            return False
+        self.settled_above.add(settle_index)
+        while self.settle_index + 1 in self.settled_above:
+            self.settle_index += 1
+            self.settled_above.remove(self.settle_index)
+        return True
+
+    async def catch_up(self):
+        cursor = await run_query(InvoiceQueries.get_catch_up_cursor)
+        self.add_index = cursor['add_index']
+        self.settle_index = cursor['settle_index']
+        self.handled_settle_index = cursor['settle_index']
+        self.flushed_settle_index = cursor['settle_index']
+        index_offset = cursor['index_offset']
+        loaded = 0
+        while True:
+            # lnd_grpc pages backwards by default, catch-up reads forwards
+            # from the offset so that later settles are not skipped
+            response = await self.rpc.list_invoices(
+                index_offset=index_offset,
+                num_max_invoices=CATCH_UP_PAGE_SIZE,
+                reversed=False
+            )
+            invoices = [
+                invoice for invoice in response.invoices
+                if invoice.add_index > self.add_index
+                or invoice.settle_index > self.settle_index
+            ]
+            await run_query(InvoiceQueries.bulk_upsert, invoices,
+                            local_pubkey=self.local_pubkey)
+            loaded += len(invoices)
+            self.add_index = max([self.add_index]
+                                 + [i.add_index for i in response.invoices])
+            settled = sorted(
+                (i for i in invoices if i.settle_index > self.settle_index),
+                key=lambda i: i.settle_index
+            )
+            for invoice in settled:
+                self.bulk_loaded_settle_index = max(
+                    self.bulk_loaded_settle_index,
+                    invoice.settle_index
+                )
+                if self.mark_settled(invoice.settle_index):
+                    await self.workers.submit(invoice.r_hash, invoice)
+            if len(response.invoices) < CATCH_UP_PAGE_SIZE:
+                break
+            index_offset = response.last_index_offset
+        log.info('Caught up on invoices', loaded=loaded,
+                 add_index=self.add_index, settle_index=self.settle_index)
 
     async def run(self):
-        local_pubkey = self.rpc.get_info().identity_pubkey
-        invoice_subscription = self.rpc.subscribe_invoices(
-            add_index=UpsertInvoices.get_max_add_index()
+        self.main_link.start()
+        self.channel_opening_link.start()
+        self.workers.start()
+        self.local_pubkey = (await self.rpc.get_info()).identity_pubkey
+        await self.unpaid_invoices.start()
+        await run_query(ChannelOpenJobQueries.create_table)
+        await run_query(InvoiceQueries.create_table)
+        await self.catch_up()
+        asyncio.ensure_future(self.flush_cursor())
+        # LND replays everything past both indexes before live updates, so
+        # anything added or settled during the catch-up is not missed
+        invoice_subscription = self.rpc.stream(
+            'subscribe_invoices',
+            add_index=self.add_index,
+            settle_index=self.settle_index,
+            max_pending=MAX_PENDING_INVOICES
         )
-        for invoice in invoice_subscription:
-            await self.handle_invoice(local_pubkey, invoice)
+        async for invoice in invoice_subscription:
+            # Invoices that are being added, not settled
+            if not invoice.settle_date:
+                continue
+            if not self.mark_settled(invoice.settle_index):
+                continue
+            await self.workers.submit(invoice.r_hash, invoice)
 
 
 if __name__ == '__main__':
@@ -126,12 +274,12 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    rpc = Client(
+    rpc = AsyncClient(Client(
         grpc_host=args.host,
         grpc_port=args.port,
         macaroon_path=args.macaroon,
         tls_cert_path=args.tls
-    )
+    ))
 
     invoice_server = InvoiceServer(rpc=rpc)
 
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+from website.logger import log
+from websocket.async_client import AsyncClient
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import ChannelQueries
+
+# Channel events do not carry balance changes, so the index is reloaded
+# from list_channels on this interval to keep the balance ratio current
+RESYNC_INTERVAL = 60
+
+# Past this age the index is considered lagging and SQL is used instead
+MAX_INDEX_LAG = 5 * 60
+
+RESUBSCRIBE_DELAY = 5
+
+
+class PeerChannelIndex(object):
+    # remote_pubkey: {channel_point: (capacity, local_balance)}
+    channels: Dict[str, Dict[str, tuple]]
+
+    def __init__(self, rpc: AsyncClient):
+        self.rpc = rpc
+        self.channels = {}
+        self.synced_at = None
+        self.subscribed = False
+        self.tasks = []
+        metrics.register_gauge('channel_index_lag', self.lag)
+
+    def lag(self) -> Optional[float]:
+        if self.synced_at is None:
+            return None
+        return time.monotonic() - self.synced_at
+
+    def is_fresh(self) -> bool:
+        lag = self.lag()
+        return self.subscribed and lag is not None and lag < MAX_INDEX_LAG
+
+    def add_channel(self, channel):
+        peer_channels = self.channels.setdefault(channel.remote_pubkey, {})
+        peer_channels[channel.channel_point] = (channel.capacity,
+                                                channel.local_balance)
+
+    def remove_channel(self, remote_pubkey: str, channel_point: str):
+        peer_channels = self.channels.get(remote_pubkey, {})
+        peer_channels.pop(channel_point, None)
+        if not peer_channels:
+            self.channels.pop(remote_pubkey, None)
+
+    async def load(self):
+        channels = await self.rpc.list_channels()
+        self.channels = {}
+        for channel in channels:
+            self.add_channel(channel)
+        self.synced_at = time.monotonic()
+        log.debug('Loaded channel index', peers=len(self.channels))
+
+    def apply_event(self, event):
+        update = event.WhichOneof('channel')
+        if update == 'open_channel':
+            self.add_channel(event.open_channel)
+        elif update == 'closed_channel':
+            self.remove_channel(event.closed_channel.remote_pubkey,
+                                event.closed_channel.channel_point)
+
+    async def subscribe(self):
+        while True:
+            try:
+                await self.load()
+                self.subscribed = True
+                async for event in self.rpc.stream('subscribe_channel_events'):
+                    self.apply_event(event)
+            except Exception:
+                log.error('Channel event subscription failed', exc_info=True)
+            self.subscribed = False
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    async def resync(self):
+        while True:
+            await asyncio.sleep(RESYNC_INTERVAL)
+            if not self.subscribed:
+                continue
+            try:
+                await self.load()
+            except Exception:
+                log.error('Channel index resync failed', exc_info=True)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.ensure_future(self.subscribe()),
+                          asyncio.ensure_future(self.resync())]
+
+    def get_peer_channel_totals(self, remote_pubkey: str) -> Optional[dict]:
+        peer_channels = self.channels.get(remote_pubkey, None)
+        if not peer_channels:
+            return None
+        capacity = sum(c for c, _ in peer_channels.values())
+        local_balance = sum(b for _, b in peer_channels.values())
+        return {
+            'remote_pubkey': remote_pubkey,
+            'count': len(peer_channels),
+            'capacity': str(capacity),
+            'balance': float(local_balance) / capacity if capacity else None
+        }
+
+    async def peer_channel_totals(self, remote_pubkey: str) -> Optional[dict]:
+        if self.is_fresh():
+            return self.get_peer_channel_totals(remote_pubkey)
+        log.debug('Channel index lagging, falling back to SQL',
+                  lag=self.lag())
+        return await run_query(ChannelQueries.get_peer_channel_totals,
+                               remote_pubkey)
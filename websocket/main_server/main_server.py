@@ -1,4 +1,7 @@
+import functools
+import ipaddress
 import json
+import multiprocessing
 import ssl
 from uuid import UUID
 
@@ -6,6 +9,11 @@ from aiohttp import web, WSMsgType
 from lnd_grpc.lnd_grpc import Client
 
 from website.logger import log
+from websocket.async_client import AsyncClient
+from websocket.internal_link import RecentMessageIds, handle_once
+from websocket.main_server.routing_bus import PostgresRoutingBus
+from websocket.metrics import metrics
+from websocket.queries import status_journal
 from websocket.logging_middleware import error_middleware
 from websocket.main_server.sessions.session_registry import SessionRegistry
 from websocket.constants import (
@@ -19,6 +27,20 @@ class MainWebsocket(web.View):
         websocket = web.WebSocketResponse()
         await websocket.prepare(self.request)
 
+        # Release the browser sessions as soon as their websocket closes
+        session_ids = set()
+        try:
+            await self.receive(websocket, session_ids)
+        finally:
+            for session_id in session_ids:
+                await self.request.app['sessions'].unregister(
+                    session_id=session_id,
+                    session_websocket=websocket
+                )
+        return websocket
+
+    async def receive(self, websocket: web.WebSocketResponse,
+                      session_ids: set):
         async for msg in websocket:
             if msg.type == WSMsgType.text:
                 if msg.data == 'close':
@@ -30,68 +52,141 @@ class MainWebsocket(web.View):
                     'ws connection closed with exception %s' % websocket.exception())
                 return
 
+            # The invoice and channel servers share one persistent link, so
+            # a bad message is skipped rather than closing it for everyone
             # noinspection PyBroadException
             try:
-                data_from_client = json.loads(msg.data)
-            except:
+                await self.handle_message(websocket, msg.data, session_ids)
+            except Exception:
                 log.error(
-                    'Error loading json',
+                    'Error handling message',
                     exc_info=True,
                     data_string_from_client=msg.data
                 )
-                return
 
-            session_id = data_from_client.get('session_id', None)
-            if session_id is None:
-                log.error(
-                    'session_id is missing',
-                    data_string_from_client=msg.data
-                )
-                return
+    async def handle_message(self, websocket: web.WebSocketResponse,
+                             data_string: str, session_ids: set):
+        # noinspection PyBroadException
+        try:
+            data_from_client = json.loads(data_string)
+        except:
+            log.error(
+                'Error loading json',
+                exc_info=True,
+                data_string_from_client=data_string
+            )
+            return
 
-            try:
-                UUID(session_id, version=4)
-            except ValueError:
-                log.error(
-                    'Invalid session_id',
-                    data_string_from_client=msg.data
-                )
-                return
+        session_id = data_from_client.get('session_id', None)
+        if session_id is None:
+            log.error(
+                'session_id is missing',
+                data_string_from_client=data_string
+            )
+            return
+
+        try:
+            UUID(session_id, version=4)
+        except ValueError:
+            log.error(
+                'Invalid session_id',
+                data_string_from_client=data_string
+            )
+            return
 
-            server_id = data_from_client.get('server_id', None)
+        server_id = data_from_client.get('server_id', None)
 
-            if server_id is None:
-                await self.request.app['sessions'].handle_session_message(
-                    session_websocket=websocket,
+        if server_id is None:
+            session_ids.add(session_id)
+            await self.request.app['sessions'].handle_session_message(
+                session_websocket=websocket,
+                session_id=session_id,
+                data_from_client=data_from_client
+            )
+        elif server_id == INVOICES_SERVER_ID:
+            invoice_data = data_from_client['invoice_data']
+            invoice_data['action'] = 'receive_payment'
+            log.debug('emit invoice_data', invoice_data=invoice_data)
+            await handle_once(
+                websocket=websocket,
+                data=data_from_client,
+                recent=self.request.app['recent_message_ids'],
+                handle=functools.partial(
+                    self.request.app['sessions'].route_session_message,
                     session_id=session_id,
-                    data_from_client=data_from_client
-                )
-                continue
-            elif server_id == INVOICES_SERVER_ID:
-                invoice_data = data_from_client['invoice_data']
-                invoice_data['action'] = 'receive_payment'
-                log.debug('emit invoice_data', invoice_data=invoice_data)
-                await self.request.app['sessions'].handle_session_message(
-                    session_id=data_from_client['session_id'],
                     data_from_client=invoice_data
                 )
-            elif server_id == CHANNELS_SERVER_ID:
-                message = {
-                    'error': data_from_client.get('error', None),
-                    'open_channel_update': data_from_client.get(
-                        'open_channel_update', None),
-                    'action': 'channel_open'
-                }
-                await self.request.app['sessions'].handle_session_message(
+            )
+        elif server_id == CHANNELS_SERVER_ID:
+            message = {
+                'error': data_from_client.get('error', None),
+                'open_channel_update': data_from_client.get(
+                    'open_channel_update', None),
+                'action': 'channel_open'
+            }
+            await handle_once(
+                websocket=websocket,
+                data=data_from_client,
+                recent=self.request.app['recent_message_ids'],
+                handle=functools.partial(
+                    self.request.app['sessions'].route_session_message,
                     session_id=session_id,
                     data_from_client=message
                 )
-            else:
-                log.error(
-                    'Invalid server_id',
-                    data_string_from_client=msg.data
-                )
-                return
+            )
+        else:
+            log.error(
+                'Invalid server_id',
+                data_string_from_client=data_string
+            )
+
+
+class StatsView(web.View):
+    async def get(self):
+        # The websocket port is public, only answer callers on this host
+        remote = self.request.remote
+        if remote is None or not ipaddress.ip_address(remote).is_loopback:
+            raise web.HTTPNotFound()
+        return web.json_response(metrics.to_dict())
+
+
+async def start_sessions(app: web.Application):
+    await app['sessions'].start()
+
+
+async def flush_status_journal(app: web.Application):
+    await status_journal.flush()
+
+
+def run_worker(args, bus=None):
+    if args.sslcert:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(certfile=args.sslcert, keyfile=args.sslkey)
+    else:
+        ssl_context = None
+
+    app = web.Application(middlewares=[error_middleware])
+    app['grpc'] = AsyncClient(Client(
+        grpc_host=args.host,
+        grpc_port=args.port,
+        macaroon_path=args.macaroon,
+        tls_cert_path=args.tls
+    ))
+    app['sessions'] = SessionRegistry(app['grpc'], bus=bus)
+    app['recent_message_ids'] = RecentMessageIds()
+    app.on_startup.append(start_sessions)
+    app.on_cleanup.append(flush_status_journal)
+    app.add_routes([
+        web.get('/', MainWebsocket),
+        web.get('/stats', StatsView)
+    ])
+
+    web.run_app(app, host=args.wshost, port=8765, ssl_context=ssl_context,
+                reuse_port=bus is not None)
+
+
+def run_routed_worker(args):
+    run_worker(args, bus=PostgresRoutingBus())
 
 
 if __name__ == '__main__':
@@ -148,21 +243,24 @@ if __name__ == '__main__':
         default='localhost'
     )
 
-    args = parser.parse_args()
-    if args.sslcert:
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-        ssl_context.load_cert_chain(certfile=args.sslcert, keyfile=args.sslkey)
-    else:
-        ssl_context = None
-
-    app = web.Application(middlewares=[error_middleware])
-    app['grpc'] = Client(
-        grpc_host=args.host,
-        grpc_port=args.port,
-        macaroon_path=args.macaroon,
-        tls_cert_path=args.tls
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of worker processes sharing the WS port',
+        default=1
     )
-    app['sessions'] = SessionRegistry(app['grpc'])
-    app.add_routes([web.get('/', MainWebsocket)])
 
-    web.run_app(app, host=args.wshost, port=8765, ssl_context=ssl_context)
+    args = parser.parse_args()
+    if args.workers > 1:
+        # Every worker binds the port with SO_REUSEPORT and server messages
+        # are routed to the owner of the session through Postgres NOTIFY
+        workers = [
+            multiprocessing.Process(target=run_routed_worker, args=(args,))
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        run_worker(args)
@@ -0,0 +1,116 @@
+import asyncio
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# noinspection PyProtectedMember
+from grpc._channel import _Rendezvous
+from lnd_grpc.protos import rpc_pb2 as ln
+
+from website.logger import log
+from websocket.async_client import AsyncClient
+
+# Delay before starting the attempt on the next candidate address,
+# unless the previous attempt has already failed
+CONNECT_STAGGER = 0.25
+
+MAX_PREFERRED_ADDRESSES = 10000
+
+
+class PeerConnector(object):
+    preferred_addresses: OrderedDict
+    rpc: AsyncClient
+
+    def __init__(self, rpc: AsyncClient, stagger: float = CONNECT_STAGGER):
+        self.rpc = rpc
+        self.stagger = stagger
+        self.preferred_addresses = OrderedDict()
+
+    def order_candidates(self, remote_pubkey: str,
+                         candidates: List[Tuple[str, int]]
+                         ) -> List[Tuple[str, int]]:
+        preferred = self.preferred_addresses.get(remote_pubkey, None)
+        ordered = []
+        seen = set()
+        for host, timeout in candidates:
+            if host in seen:
+                continue
+            seen.add(host)
+            if host == preferred:
+                ordered.insert(0, (host, timeout))
+            else:
+                ordered.append((host, timeout))
+        return ordered
+
+    def record_winner(self, remote_pubkey: str, host: str):
+        self.preferred_addresses[remote_pubkey] = host
+        self.preferred_addresses.move_to_end(remote_pubkey)
+        if len(self.preferred_addresses) > MAX_PREFERRED_ADDRESSES:
+            self.preferred_addresses.popitem(last=False)
+
+    async def try_connect(self, remote_pubkey: str, host: str,
+                          timeout: int) -> Optional[str]:
+        # Losing attempts are cancelled in gRPC rather than left to run out
+        # their timeout on a thread of the shared RPC pool
+        request = ln.ConnectPeerRequest(
+            addr=ln.LightningAddress(pubkey=remote_pubkey, host=host)
+        )
+        try:
+            await self.rpc.call_future(
+                self.rpc.client.lightning_stub.ConnectPeer,
+                request,
+                timeout=timeout
+            )
+            return None
+        except _Rendezvous as e:
+            details = e.details()
+            # A parallel attempt on another address won the race
+            if 'already connected' in details:
+                return None
+            log.debug(
+                'Connect to peer failed',
+                remote_pubkey=remote_pubkey,
+                remote_host=host,
+                details=details
+            )
+            return details
+
+    async def wait_for_winner(self, attempts: dict, errors: list,
+                              timeout: Optional[float]) -> Optional[str]:
+        done, _ = await asyncio.wait(list(attempts), timeout=timeout,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            host = attempts.pop(task)
+            error = task.result()
+            if error is None:
+                return host
+            errors.append(error)
+        return None
+
+    async def connect(self, remote_pubkey: str,
+                      candidates: List[Tuple[str, int]]
+                      ) -> Tuple[Optional[str], Optional[str]]:
+        attempts = {}
+        errors = []
+        winner = None
+        try:
+            for host, timeout in self.order_candidates(remote_pubkey,
+                                                       candidates):
+                task = asyncio.ensure_future(
+                    self.try_connect(remote_pubkey, host, timeout)
+                )
+                attempts[task] = host
+                winner = await self.wait_for_winner(attempts, errors,
+                                                    timeout=self.stagger)
+                if winner is not None:
+                    break
+            while winner is None and attempts:
+                winner = await self.wait_for_winner(attempts, errors,
+                                                    timeout=None)
+        finally:
+            for task in attempts:
+                task.cancel()
+
+        if winner is None:
+            return None, errors[-1] if errors else None
+        self.record_winner(remote_pubkey, winner)
+        return winner, None
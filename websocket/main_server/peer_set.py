@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Optional, Set
+
+from website.logger import log
+from websocket.async_client import AsyncClient
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import ActivePeerQueries
+
+# The set is reconciled with list_peers on this interval, which also keeps
+# it current on lnd_grpc versions without subscribe_peer_events
+RECONCILE_INTERVAL = 60
+
+# Past this age the set is considered lagging and SQL is used instead
+MAX_PEER_SET_LAG = 5 * 60
+
+RESUBSCRIBE_DELAY = 5
+
+PEER_ONLINE = 0
+PEER_OFFLINE = 1
+
+
+class ConnectedPeerSet(object):
+    pubkeys: Set[str]
+
+    def __init__(self, rpc: AsyncClient):
+        self.rpc = rpc
+        self.pubkeys = set()
+        self.synced_at = None
+        self.drift = 0
+        self.subscribed = False
+        self.tasks = []
+        metrics.register_gauge('peer_set_lag', self.lag)
+        metrics.register_gauge('peer_set_drift', lambda: self.drift)
+        metrics.register_gauge('peer_set_size', lambda: len(self.pubkeys))
+
+    def lag(self) -> Optional[float]:
+        if self.synced_at is None:
+            return None
+        return time.monotonic() - self.synced_at
+
+    def is_fresh(self) -> bool:
+        lag = self.lag()
+        return lag is not None and lag < MAX_PEER_SET_LAG
+
+    def add(self, remote_pubkey: str):
+        self.pubkeys.add(remote_pubkey)
+
+    async def load(self):
+        peers = await self.rpc.list_peers()
+        pubkeys = {peer.pub_key for peer in peers}
+        if self.synced_at is not None:
+            # Peers the events missed since the last reconciliation
+            self.drift = len(pubkeys ^ self.pubkeys)
+        self.pubkeys = pubkeys
+        self.synced_at = time.monotonic()
+
+    def apply_event(self, event):
+        if event.type == PEER_ONLINE:
+            self.pubkeys.add(event.pub_key)
+        elif event.type == PEER_OFFLINE:
+            self.pubkeys.discard(event.pub_key)
+        self.synced_at = time.monotonic()
+
+    async def subscribe(self):
+        if not hasattr(self.rpc.client, 'subscribe_peer_events'):
+            log.info('subscribe_peer_events unavailable, polling list_peers')
+            return
+        while True:
+            try:
+                await self.load()
+                self.subscribed = True
+                async for event in self.rpc.stream('subscribe_peer_events'):
+                    self.apply_event(event)
+            except Exception:
+                log.error('Peer event subscription failed', exc_info=True)
+            self.subscribed = False
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    async def reconcile(self):
+        while True:
+            try:
+                await self.load()
+            except Exception:
+                log.error('Peer set reconciliation failed', exc_info=True)
+            await asyncio.sleep(RECONCILE_INTERVAL)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.ensure_future(self.subscribe()),
+                          asyncio.ensure_future(self.reconcile())]
+
+    async def is_connected(self, remote_pubkey: str) -> bool:
+        if self.is_fresh():
+            return remote_pubkey in self.pubkeys
+        log.debug('Peer set lagging, falling back to SQL', lag=self.lag())
+        return await run_query(ActivePeerQueries.is_connected, remote_pubkey)
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Callable, Optional
+
+from website.logger import log
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import ExchangeRateQueries
+
+PRICE_POLL_INTERVAL = 60
+
+
+class PriceFeed(object):
+    # Pushes the latest exchange rate to every attached session so that
+    # USD amounts stay current without a page reload
+    def __init__(self, get_sessions: Callable):
+        self.get_sessions = get_sessions
+        self.price_per_sat = None
+        self.task = None
+        metrics.register_gauge('price_per_sat', lambda: self.price_per_sat)
+
+    async def poll(self) -> Optional[float]:
+        price_per_sat = await run_query(
+            ExchangeRateQueries.get_price_per_sat
+        )
+        if price_per_sat is None or price_per_sat == self.price_per_sat:
+            return None
+        self.price_per_sat = price_per_sat
+        return price_per_sat
+
+    async def broadcast(self, price_per_sat: float):
+        message = {'action': 'price_update', 'price_per_sat': price_per_sat}
+        for session in list(self.get_sessions()):
+            # Detached sessions get a fresh price when the page reloads
+            if session.ws is None or session.ws.closed:
+                continue
+            try:
+                await session.send(message)
+            except Exception:
+                log.debug('Error sending price update', exc_info=True,
+                          session_id=session.session_id)
+
+    async def run(self):
+        while True:
+            try:
+                price_per_sat = await self.poll()
+                if price_per_sat is not None:
+                    await self.broadcast(price_per_sat)
+            except Exception:
+                log.error('Price poll failed', exc_info=True)
+            await asyncio.sleep(PRICE_POLL_INTERVAL)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import uuid
+
+import pgpubsub
+
+from lnd_sql.database.session import keyring_get_or_create
+from website.logger import log
+from websocket.executors import run_query
+from websocket.queries import RoutingPayloadQueries
+
+ROUTING_CHANNEL = 'session_routing'
+
+# pg_notify rejects payloads of 8000 bytes or more, larger messages go
+# through the routing_payloads table and only their id is notified
+MAX_PAYLOAD_SIZE = 7999
+
+
+def log_handler_error(message: dict, future):
+    # A claim whose restore could not be published keeps its record, the
+    # error still has to be seen
+    if not future.cancelled() and future.exception() is not None:
+        log.error('Error handling routing message',
+                  exc_info=future.exception(), message_type=message['type'],
+                  session_id=message.get('session_id', None))
+
+
+def connect_pubsub():
+    return pgpubsub.connect(
+        database=keyring_get_or_create('LPU_PGDATABASE'),
+        user=keyring_get_or_create('LPU_PGUSER'),
+        password=keyring_get_or_create('LPU_PGPASSWORD'),
+        host=os.environ.get('LPU_PGHOST', '127.0.0.1'),
+        port=os.environ.get('LPU_PGPORT', '5432'),
+    )
+
+
+class PostgresRoutingBus(object):
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.notifier = None
+
+    async def start(self, handler):
+        loop = asyncio.get_event_loop()
+        await run_query(RoutingPayloadQueries.create_table)
+        self.notifier = await run_query(connect_pubsub)
+
+        def listen():
+            pubsub = connect_pubsub()
+            pubsub.listen(ROUTING_CHANNEL)
+            for event in pubsub.events():
+                # noinspection PyBroadException
+                try:
+                    message = json.loads(event.payload)
+                    if 'payload_id' in message:
+                        message = json.loads(
+                            RoutingPayloadQueries.get(message['payload_id'])
+                        )
+                except:
+                    log.error('Error loading routing message', exc_info=True,
+                              payload=event.payload)
+                    continue
+                future = asyncio.run_coroutine_threadsafe(handler(message),
+                                                          loop)
+                future.add_done_callback(functools.partial(
+                    log_handler_error, message
+                ))
+
+        threading.Thread(target=listen, name='routing-bus',
+                         daemon=True).start()
+
+    async def publish(self, message: dict):
+        message['worker_id'] = self.worker_id
+        payload = json.dumps(message)
+        if len(payload.encode('utf8')) > MAX_PAYLOAD_SIZE:
+            payload_id = await run_query(RoutingPayloadQueries.store, payload)
+            payload = json.dumps({'payload_id': payload_id})
+        await run_query(self.notifier.notify, ROUTING_CHANNEL, payload)
+
+
+class LocalRoutingBus(object):
+    # In-process stand-in for PostgresRoutingBus, every bus sharing a hub
+    # receives the messages published on any of them, its own included
+    def __init__(self, hub: list):
+        self.worker_id = uuid.uuid4().hex
+        self.hub = hub
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+        self.hub.append(self)
+
+    async def publish(self, message: dict):
+        message['worker_id'] = self.worker_id
+        # Serialized like a notification so that no state is shared
+        payload = json.dumps(message)
+        for bus in self.hub:
+            routed = json.loads(payload)
+            future = asyncio.ensure_future(bus.handler(routed))
+            future.add_done_callback(functools.partial(
+                log_handler_error, routed
+            ))
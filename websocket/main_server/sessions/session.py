@@ -1,42 +1,66 @@
+import asyncio
 import json
+import time
 from decimal import Decimal
 
 from aiohttp.web_ws import WebSocketResponse
-from flask_qrcode import QRcode
-# noinspection PyProtectedMember
-from grpc._channel import _Rendezvous
 from structlog import get_logger
-from lnd_grpc.lnd_grpc import Client
 from lnd_sql.scripts.upsert_invoices import UpsertInvoices
 
 from website.constants import EXPECTED_BYTES, CAPACITY_FEE_RATES
-from websocket.constants import PUBKEY_LENGTH
+from websocket.async_client import AsyncClient
+from websocket.constants import CAPACITY_REQUEST_MEMO, PUBKEY_LENGTH
+from websocket.executors import run_query
+from websocket.main_server.channel_index import PeerChannelIndex
+from websocket.main_server.peer_connector import PeerConnector
+from websocket.main_server.peer_set import ConnectedPeerSet
+from websocket.metrics import track_phase
+from websocket.qr_codes import render_qr_code
 from websocket.queries import (
-    ActivePeerQueries,
-    ChannelQueries,
     InboundCapacityRequestQueries,
-    LightningAddressesQueries
+    LightningAddressesQueries,
+    status_journal
 )
+from websocket.utxo_reservations import UtxoReservations
 
 
+AWAITING_PAYMENT = 'awaiting_payment'
+AWAITING_CHANNEL_OPEN = 'awaiting_channel_open'
+
+IN_FLIGHT_STATES = (AWAITING_PAYMENT, AWAITING_CHANNEL_OPEN)
+
 
 class Session(object):
+    channel_index: PeerChannelIndex
     reciprocate_capacity: int
     remote_host: str
     remote_pubkey: str
-    rpc: Client
+    connector: PeerConnector
+    peer_set: ConnectedPeerSet
+    rpc: AsyncClient
     session_id: str
+    state: str
+    wallet: UtxoReservations
     ws: WebSocketResponse
 
     def __init__(self,
                  session_id: str,
                  local_pubkey: str,
                  ws: WebSocketResponse,
-                 rpc: Client):
+                 rpc: AsyncClient,
+                 connector: PeerConnector,
+                 channel_index: PeerChannelIndex,
+                 peer_set: ConnectedPeerSet,
+                 wallet: UtxoReservations):
         self.session_id = session_id
+        self.request_id = None
         self.local_pubkey = local_pubkey
         self.ws = ws
         self.rpc = rpc
+        self.connector = connector
+        self.channel_index = channel_index
+        self.peer_set = peer_set
+        self.wallet = wallet
 
         self.remote_host = None
         self.remote_pubkey = None
@@ -50,14 +74,24 @@ class Session(object):
         self.transaction_fee = None
         self.total_fee = None
 
-        self.invoice = None
+        self.r_hash = None
+        self.persist_task = None
+
+        self.state = None
+        self.undelivered = None
+        self.last_activity = time.monotonic()
 
         logger = get_logger()
         self.log = logger.bind(session_id=session_id)
 
     async def send(self, message):
+        if self.ws is None or self.ws.closed:
+            # Kept so that it can be replayed if the browser registers again
+            self.undelivered = message
+            return
         message_string = json.dumps(message)
-        await self.ws.send_str(message_string)
+        with track_phase('send'):
+            await self.ws.send_str(message_string)
 
     async def send_registered(self):
         message = {
@@ -65,10 +99,13 @@ class Session(object):
         }
         await self.send(message=message)
 
-        InboundCapacityRequestQueries.insert(self.session_id)
+        self.request_id = await run_query(
+            InboundCapacityRequestQueries.insert,
+            self.session_id
+        )
 
     async def send_connected(self, status: str):
-        data = ChannelQueries.get_peer_channel_totals(self.remote_pubkey)
+        data = await self.channel_index.peer_channel_totals(self.remote_pubkey)
         self.log.debug('get_peer_channel_totals', data=data)
 
         if data is not None:
@@ -95,8 +132,8 @@ class Session(object):
         }
         await self.send(message=message)
 
-        InboundCapacityRequestQueries.update_connection(
-            session_id=self.session_id,
+        await status_journal.update_connection(
+            request_id=self.request_id,
             remote_pubkey=self.remote_pubkey,
             remote_host=self.remote_host,
             status=status
@@ -109,8 +146,7 @@ class Session(object):
         }
         await self.send(message=message)
         if status is not None:
-            InboundCapacityRequestQueries.update_status(self.session_id,
-                                                        status=error)
+            await status_journal.update_status(self.request_id, status=error)
 
     async def send_confirmed_capacity(self):
         message = {
@@ -118,45 +154,56 @@ class Session(object):
         }
         await self.send(message=message)
 
-        InboundCapacityRequestQueries.update_capacity(
-            session_id=self.session_id,
+        await status_journal.update_capacity(
+            request_id=self.request_id,
             capacity=self.capacity,
             capacity_fee_rate=self.capacity_fee_rate,
             status='confirmed_capacity'
         )
 
-    async def send_payreq(self, payment_request, uri, qrcode):
+    async def send_payreq(self, payment_request, uri, qrcode: dict):
         self.log.debug('send_payreq')
         message = {
             'action': 'payment_request',
             'payment_request': payment_request,
-            'qrcode': qrcode,
             'uri': uri
         }
+        message.update(qrcode)
         await self.send(message=message)
+        self.state = AWAITING_PAYMENT
 
-        UpsertInvoices.upsert(
-            single_invoice=self.invoice,
-            local_pubkey=self.local_pubkey
-        )
-
-        InboundCapacityRequestQueries.update_tx_fee_and_invoice(
-            session_id=self.session_id,
-            transaction_fee_rate=self.transaction_fee_rate,
-            r_hash=self.invoice.r_hash.hex(),
-            status='confirmed_chain_fee_and_invoice_sent'
-        )
+    async def persist_invoice(self, r_hash: bytes):
+        # The capacity request is updated first, the invoice server needs
+        # the r_hash to match the payment once it settles
+        try:
+            await status_journal.update_tx_fee_and_invoice(
+                request_id=self.request_id,
+                transaction_fee_rate=self.transaction_fee_rate,
+                capacity_fee=self.capacity_fee,
+                r_hash=r_hash.hex(),
+                status='confirmed_chain_fee_and_invoice_sent'
+            )
+            invoice = await self.rpc.lookup_invoice(r_hash=r_hash)
+            await run_query(
+                UpsertInvoices.upsert,
+                single_invoice=invoice,
+                local_pubkey=self.local_pubkey
+            )
+        except Exception:
+            self.log.error('Persisting invoice failed', exc_info=True,
+                           r_hash=r_hash.hex())
 
     async def send_receive_payment(self):
         message = {
             'action': 'receive_payment'
         }
         await self.send(message=message)
+        self.state = AWAITING_CHANNEL_OPEN
 
-        InboundCapacityRequestQueries.update_status(self.session_id,
-                                                    'payment_received')
+        await status_journal.update_status(self.request_id, 'payment_received')
 
     async def send_channel_open(self, data: dict):
+        self.state = None
         if data.get('error', None):
             await self.send_error_message(data['error'])
             return
@@ -167,8 +214,7 @@ class Session(object):
             'txid': txid
         }
         await self.send(message=message)
-        InboundCapacityRequestQueries.update_status(self.session_id,
-                                                    'channel_opened')
+        await status_journal.update_status(self.request_id, 'channel_opened')
 
     async def parse_remote_pubkey(self, remote_pubkey_input: str):
         self.remote_pubkey = remote_pubkey_input.strip()
@@ -194,8 +240,8 @@ class Session(object):
             await self.send_error_message(
                 error='Invalid PubKey format'
             )
-            InboundCapacityRequestQueries.update_connection(
-                session_id=self.session_id,
+            await status_journal.update_connection(
+                request_id=self.request_id,
                 remote_pubkey=self.remote_pubkey,
                 remote_host=self.remote_host,
                 status='invalid_pubkey'
@@ -216,8 +262,8 @@ class Session(object):
             await self.send_error_message(
                 error=error
             )
-            InboundCapacityRequestQueries.update_connection(
-                session_id=self.session_id,
+            await status_journal.update_connection(
+                request_id=self.request_id,
                 remote_pubkey=self.remote_pubkey,
                 remote_host=self.remote_host,
                 status='invalid_pubkey'
@@ -231,22 +277,6 @@ class Session(object):
             remote_host=self.remote_host
         )
 
-    async def try_connect(self, timeout=10):
-        address = '@'.join([self.remote_pubkey, self.remote_host])
-        try:
-            self.rpc.connect(address=address, timeout=timeout)
-            return None
-        except _Rendezvous as e:
-            details = e.details()
-            self.log.error(
-                'Connect to peer failed',
-                remote_pubkey=self.remote_pubkey,
-                remote_host=self.remote_host,
-                details=details,
-                exc_info=True
-            )
-            return details
-
     async def connect_to_peer(self, remote_pubkey_input: str):
         self.log.debug(
             'connect_to_peer',
@@ -256,9 +286,7 @@ class Session(object):
         if not self.remote_pubkey:
             return
 
-        error = None
-
-        is_connected = ActivePeerQueries.is_connected(self.remote_pubkey)
+        is_connected = await self.peer_set.is_connected(self.remote_pubkey)
         if is_connected:
             self.log.debug(
                 'Already connected to peer',
@@ -272,30 +300,37 @@ class Session(object):
                 remote_pubkey=self.remote_pubkey
             )
 
-        # Use user input host:port
-        if self.remote_host is not None:
-            error = await self.try_connect()
-            if error is None:
+        # Race the user input host:port against the public graph addresses
+        input_host = self.remote_host
+        candidates = []
+        if input_host is not None:
+            candidates.append((input_host, 10))
+        addresses = await run_query(LightningAddressesQueries.get,
+                                    self.remote_pubkey)
+        if addresses is not None:
+            candidates.extend([(address, 3) for address in addresses])
+
+        winner, error = await self.connector.connect(
+            remote_pubkey=self.remote_pubkey,
+            candidates=candidates
+        )
+        if winner is not None:
+            self.remote_host = winner
+            self.peer_set.add(self.remote_pubkey)
+            if winner == input_host:
                 self.log.debug(
                     'Connected with user input',
                     remote_pubkey=self.remote_pubkey
                 )
                 await self.send_connected('connected_with_input')
-                return
-
-        # Query the public graph
-        addresses = LightningAddressesQueries.get(self.remote_pubkey)
-        if addresses is not None:
-            for address in addresses:
-                self.remote_host = address
-                error = await self.try_connect(timeout=3)
-                if error is None:
-                    self.log.debug(
-                        'Connected with graph',
-                        remote_pubkey=self.remote_pubkey
-                    )
-                    await self.send_connected('connected_with_graph')
-                    return
+            else:
+                self.log.debug(
+                    'Connected with graph',
+                    remote_pubkey=self.remote_pubkey,
+                    remote_host=winner
+                )
+                await self.send_connected('connected_with_graph')
+            return
 
         self.log.debug(
             'Unknown PubKey',
@@ -306,8 +341,8 @@ class Session(object):
             error = ''
         please_connect = f'Error: {error} please connect to our node 0331f80652fb840239df8dc99205792bba2e559a05469915804c08420230e23c7c@lightningpowerusers.com:9735'
         await self.send_error_message(please_connect)
-        InboundCapacityRequestQueries.update_connection(
-            session_id=self.session_id,
+        await status_journal.update_connection(
+            request_id=self.request_id,
             remote_pubkey=self.remote_pubkey,
             remote_host=self.remote_host,
             status=error
@@ -329,8 +364,8 @@ class Session(object):
             )
             if self.capacity_fee_rate not in [c[0] for c in CAPACITY_FEE_RATES]:
                 await self.send_error_message('Invalid capacity fee rate')
-                InboundCapacityRequestQueries.update_capacity(
-                    session_id=self.session_id,
+                await status_journal.update_capacity(
+                    request_id=self.request_id,
                     capacity=self.capacity,
                     capacity_fee_rate=self.capacity_fee_rate,
                     status='invalid_capacity_fee_rate'
@@ -340,17 +375,29 @@ class Session(object):
             self.capacity_fee_rate = Decimal('0.00')
             if self.capacity != self.reciprocate_capacity:
                 await self.send_error_message('Invalid capacity')
-                InboundCapacityRequestQueries.update_capacity(
-                    session_id=self.session_id,
+                await status_journal.update_capacity(
+                    request_id=self.request_id,
                     capacity=self.capacity,
                     capacity_fee_rate=self.capacity_fee_rate,
                     status='invalid_reciprocate_capacity'
                 )
                 return
+        if not self.wallet.can_fund(self.capacity):
+            await self.send_error_message(
+                'Not enough liquidity available for this capacity, please '
+                'try a smaller amount'
+            )
+            await status_journal.update_capacity(
+                request_id=self.request_id,
+                capacity=self.capacity,
+                capacity_fee_rate=self.capacity_fee_rate,
+                status='insufficient_liquidity'
+            )
+            return
         self.capacity_fee = self.capacity * self.capacity_fee_rate
         await self.send_confirmed_capacity()
 
-    async def chain_fee(self, form_data):
+    async def chain_fee(self, form_data, qr_format: str = 'png'):
         self.log.debug(
             'chain_fee',
             session_id=self.session_id,
@@ -363,26 +410,40 @@ class Session(object):
         if not self.transaction_fee_rate > 0:
             await self.send_error_message('Invalid transaction fee rate')
             return
+        # Liquidity may have been committed since the capacity was confirmed
+        if not self.wallet.can_fund(self.capacity):
+            await self.send_error_message(
+                'Not enough liquidity available for this capacity, please '
+                'try a smaller amount'
+            )
+            await status_journal.update_status(self.request_id,
+                                               'insufficient_liquidity')
+            return
         self.transaction_fee = self.transaction_fee_rate * EXPECTED_BYTES
         self.total_fee = self.capacity_fee + self.transaction_fee
 
-        memo = 'Lightning Power Users capacity request: '
+        memo = CAPACITY_REQUEST_MEMO
         if self.capacity_fee_rate:
             memo += f'{self.capacity} @ {self.capacity_fee_rate}'
         else:
             memo += f'reciprocate {self.capacity}'
 
-        add_invoice_response = self.rpc.add_invoice(
+        add_invoice_response = await self.rpc.add_invoice(
             value=int(self.total_fee),
             memo=memo
         )
-        self.invoice = self.rpc.lookup_invoice(r_hash=add_invoice_response.r_hash)
+        self.r_hash = add_invoice_response.r_hash.hex()
+        self.persist_task = asyncio.ensure_future(
+            self.persist_invoice(add_invoice_response.r_hash)
+        )
 
-        uri = ':'.join(['lightning', self.invoice.payment_request])
-        qrcode = QRcode.qrcode(uri, border=10)
+        # Everything the client needs is in the AddInvoiceResponse
+        payment_request = add_invoice_response.payment_request
+        uri = ':'.join(['lightning', payment_request])
+        qrcode = await render_qr_code(uri, qr_format=qr_format)
 
         await self.send_payreq(
-            payment_request=self.invoice.payment_request,
+            payment_request=payment_request,
             uri=uri,
             qrcode=qrcode
         )
@@ -0,0 +1,16 @@
+import time
+
+
+class SessionRecord(object):
+    # Compact stand-in for a Session whose browser websocket is gone but
+    # which is still waiting on the invoice or channel opening server
+    __slots__ = ('session_id', 'request_id', 'state', 'undelivered',
+                 'updated_at')
+
+    def __init__(self, session_id: str, request_id: int, state: str,
+                 undelivered: dict = None):
+        self.session_id = session_id
+        self.request_id = request_id
+        self.state = state
+        self.undelivered = undelivered
+        self.updated_at = time.monotonic()
@@ -1,22 +1,199 @@
-from typing import Dict
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Union
 
 from aiohttp.web_ws import WebSocketResponse
 
-from lnd_grpc.lnd_grpc import Client
 from lnd_grpc.protos.rpc_pb2 import GetInfoResponse
 from website.logger import log
-from websocket.main_server.sessions.session import Session
+from websocket.async_client import AsyncClient
+from websocket.metrics import metrics
+from websocket.queries import status_journal
+from websocket.main_server.channel_index import PeerChannelIndex
+from websocket.main_server.peer_connector import PeerConnector
+from websocket.main_server.peer_set import ConnectedPeerSet
+from websocket.main_server.price_feed import PriceFeed
+from websocket.main_server.routing_bus import (
+    LocalRoutingBus,
+    PostgresRoutingBus
+)
+from websocket.main_server.sessions.session import IN_FLIGHT_STATES, Session
+from websocket.main_server.sessions.session_record import SessionRecord
+from websocket.utxo_reservations import UtxoReservations
+
+MAX_SESSIONS = 10000
+SESSION_IDLE_TTL = 60 * 60
+
+MAX_SESSION_RECORDS = 100000
+SESSION_RECORD_TTL = 7 * 24 * 60 * 60
+
+EVICTION_INTERVAL = 60
+
+# A routed message that no worker has confirmed by then is logged as lost
+DELIVERY_TIMEOUT = 10
 
 
 class SessionRegistry(object):
+    bus: Optional[Union[LocalRoutingBus, PostgresRoutingBus]]
+    channel_index: PeerChannelIndex
+    connector: PeerConnector
+    # delivery_id: session_id of routed messages no worker confirmed yet
+    deliveries: Dict[str, str]
     info: GetInfoResponse
+    peer_set: ConnectedPeerSet
+    wallet: UtxoReservations
+    records: Dict[str, SessionRecord]
     sessions: Dict[str, Session]
-    rpc: Client
+    rpc: AsyncClient
 
-    def __init__(self, rpc):
+    def __init__(self, rpc: AsyncClient,
+                 bus: Union[LocalRoutingBus, PostgresRoutingBus] = None):
         self.rpc = rpc
-        self.info = self.rpc.get_info()
-        self.sessions = {}
+        self.bus = bus
+        self.info = self.rpc.client.get_info()
+        self.connector = PeerConnector(self.rpc)
+        self.channel_index = PeerChannelIndex(self.rpc)
+        self.peer_set = ConnectedPeerSet(self.rpc)
+        self.wallet = UtxoReservations(self.rpc, track_queued_jobs=True)
+        self.price_feed = PriceFeed(lambda: self.sessions.values())
+        # Both are kept in least recently used order
+        self.sessions = OrderedDict()
+        self.records = OrderedDict()
+        self.deliveries = {}
+        self.eviction_task = None
+        # action: (handler, whether it needs the registered session)
+        self.action_handlers = {
+            'register': (self.register, False),
+            'connect': (self.handle_connect, True),
+            'capacity_request': (self.handle_capacity_request, True),
+            'chain_fee': (self.handle_chain_fee, True),
+            'receive_payment': (self.handle_receive_payment, True),
+            'channel_open': (self.handle_channel_open, True),
+        }
+
+    def owns(self, session_id: str) -> bool:
+        return session_id in self.sessions or session_id in self.records
+
+    async def start(self):
+        self.start_eviction()
+        status_journal.start()
+        self.channel_index.start()
+        self.peer_set.start()
+        self.wallet.start()
+        self.price_feed.start()
+        if self.bus is not None:
+            await self.bus.start(self.handle_bus_message)
+
+    async def route_session_message(self, session_id: str,
+                                    data_from_client: dict):
+        # Invoice and channel server messages can reach any worker, they are
+        # forwarded to the worker that owns the browser session
+        if self.bus is None or self.owns(session_id):
+            await self.handle_session_message(
+                session_id=session_id,
+                data_from_client=data_from_client
+            )
+            return
+        delivery_id = uuid.uuid4().hex
+        self.deliveries[delivery_id] = session_id
+        await self.bus.publish({
+            'type': 'deliver',
+            'session_id': session_id,
+            'delivery_id': delivery_id,
+            'data_from_client': data_from_client
+        })
+        asyncio.get_event_loop().call_later(
+            DELIVERY_TIMEOUT, self.check_delivery, delivery_id,
+            data_from_client
+        )
+
+    def check_delivery(self, delivery_id: str, data_from_client: dict):
+        session_id = self.deliveries.pop(delivery_id, None)
+        if session_id is not None:
+            log.error('No worker owns the session, routed message lost',
+                      session_id=session_id,
+                      data_from_client=data_from_client)
+
+    async def handle_bus_message(self, message: dict):
+        if message.get('worker_id', None) == self.bus.worker_id:
+            return
+        session_id = message['session_id']
+        message_type = message['type']
+        if message_type == 'deliver':
+            if self.owns(session_id):
+                await self.handle_session_message(
+                    session_id=session_id,
+                    data_from_client=message['data_from_client']
+                )
+                await self.bus.publish({
+                    'type': 'delivered',
+                    'session_id': session_id,
+                    'delivery_id': message.get('delivery_id', None)
+                })
+        elif message_type == 'delivered':
+            self.deliveries.pop(message['delivery_id'], None)
+        elif message_type == 'claim':
+            # The browser registered again on another worker, hand over
+            # whatever this worker still knows about the session. The record
+            # is only dropped once the hand-over has been published
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                self.compact(session)
+            record = self.records.get(session_id, None)
+            if record is not None:
+                await self.bus.publish({
+                    'type': 'restore',
+                    'session_id': session_id,
+                    'request_id': record.request_id,
+                    'state': record.state,
+                    'undelivered': record.undelivered
+                })
+                if self.records.get(session_id, None) is record:
+                    del self.records[session_id]
+        elif message_type == 'restore':
+            session = self.sessions.get(session_id, None)
+            if session is None:
+                return
+            if session.state is None and message['state'] is not None:
+                session.state = message['state']
+                session.request_id = message['request_id']
+            if message['undelivered'] is not None:
+                await session.send(message['undelivered'])
+        else:
+            log.debug('Unknown routing message', message=message)
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        session = self.sessions.get(session_id, None)
+        if session is not None:
+            session.last_activity = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            return session
+
+        record = self.records.get(session_id, None)
+        if record is None:
+            return None
+        # Rebuild a detached session so that server messages still update
+        # the capacity request, it is compacted again once handled
+        session = self.new_session(session_id=session_id, ws=None)
+        session.request_id = record.request_id
+        session.state = record.state
+        session.undelivered = record.undelivered
+        return session
+
+    def new_session(self, session_id: str,
+                    ws: Optional[WebSocketResponse]) -> Session:
+        return Session(
+            session_id=session_id,
+            local_pubkey=self.info.identity_pubkey,
+            ws=ws,
+            rpc=self.rpc,
+            connector=self.connector,
+            channel_index=self.channel_index,
+            peer_set=self.peer_set,
+            wallet=self.wallet
+        )
 
     async def handle_session_message(
             self,
@@ -28,40 +205,72 @@ class SessionRegistry(object):
         if action is None:
             return
 
-        if action == 'register':
-            await self.register(
-                session_id=session_id,
-                session_websocket=session_websocket
+        if action not in self.action_handlers:
+            log.debug(
+                'Unknown action',
+                action=action,
+                data_from_client=data_from_client
             )
-        elif action == 'connect':
-            log.debug('connect', data_from_client=data_from_client)
-            form_data = data_from_client.get('form_data', None)
-            form_data_pubkey = [f for f in form_data
-                                if f['name'] == 'pubkey'][0]
-            if not len(form_data_pubkey):
+            return
+
+        handler, needs_session = self.action_handlers[action]
+        with metrics.track_action(action):
+            if not needs_session:
+                await handler(
+                    session_id=session_id,
+                    session_websocket=session_websocket
+                )
+                return
+
+            session = self.get_session(session_id)
+            if session is None:
                 log.debug(
-                    'Connect did not include valid form data',
-                    data_from_client=data_from_client
+                    'Message for unknown session',
+                    session_id=session_id,
+                    action=action
                 )
                 return
-            pubkey = form_data_pubkey.get('value', '').strip()
-            await self.sessions[session_id].connect_to_peer(pubkey)
-        elif action == 'capacity_request':
-            form_data = data_from_client.get('form_data', None)
-            await self.sessions[session_id].confirm_capacity(form_data)
-        elif action == 'chain_fee':
-            form_data = data_from_client.get('form_data', None)
-            await self.sessions[session_id].chain_fee(form_data)
-        elif action == 'receive_payment':
-            await self.sessions[session_id].send_receive_payment()
-        elif action == 'channel_open':
-            await self.sessions[session_id].send_channel_open(data_from_client)
-        else:
+            try:
+                await handler(session, data_from_client)
+            finally:
+                if session.ws is None:
+                    self.compact(session)
+
+    @staticmethod
+    async def handle_connect(session: Session, data_from_client: dict):
+        log.debug('connect', data_from_client=data_from_client)
+        form_data = data_from_client.get('form_data', None)
+        form_data_pubkey = [f for f in form_data
+                            if f['name'] == 'pubkey'][0]
+        if not len(form_data_pubkey):
             log.debug(
-                'Unknown action',
-                action=action,
+                'Connect did not include valid form data',
                 data_from_client=data_from_client
             )
+            return
+        pubkey = form_data_pubkey.get('value', '').strip()
+        await session.connect_to_peer(pubkey)
+
+    @staticmethod
+    async def handle_capacity_request(session: Session,
+                                      data_from_client: dict):
+        form_data = data_from_client.get('form_data', None)
+        await session.confirm_capacity(form_data)
+
+    @staticmethod
+    async def handle_chain_fee(session: Session, data_from_client: dict):
+        form_data = data_from_client.get('form_data', None)
+        qr_format = data_from_client.get('qr_format', 'png')
+        await session.chain_fee(form_data, qr_format=qr_format)
+
+    @staticmethod
+    async def handle_receive_payment(session: Session,
+                                     data_from_client: dict):
+        await session.send_receive_payment()
+
+    @staticmethod
+    async def handle_channel_open(session: Session, data_from_client: dict):
+        await session.send_channel_open(data_from_client)
 
     async def register(self, session_id: str,
                        session_websocket: WebSocketResponse):
@@ -69,13 +278,88 @@ class SessionRegistry(object):
             'Registering session_id',
             session_id=session_id
         )
-        self.sessions[session_id] = Session(
-            session_id=session_id,
-            local_pubkey=self.info.identity_pubkey,
-            ws=session_websocket,
-            rpc=self.rpc,
-        )
-        await self.sessions[session_id].send_registered()
+        session = self.new_session(session_id=session_id,
+                                   ws=session_websocket)
+        record = self.records.pop(session_id, None)
+        if record is not None:
+            session.state = record.state
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        await session.send_registered()
+        if record is not None and record.state in IN_FLIGHT_STATES:
+            # Payment and channel updates still belong to the earlier row
+            session.request_id = record.request_id
+        if record is not None and record.undelivered is not None:
+            await session.send(record.undelivered)
+        self.evict_overflow()
+        if self.bus is not None:
+            await self.bus.publish({
+                'type': 'claim',
+                'session_id': session_id
+            })
 
-    async def unregister(self, session_id: str):
+    async def unregister(self, session_id: str,
+                         session_websocket: WebSocketResponse = None):
+        session = self.sessions.get(session_id, None)
+        if session is None:
+            return
+        # The browser may have registered again on a newer websocket
+        if session_websocket is not None \
+                and session.ws is not session_websocket:
+            return
         del self.sessions[session_id]
+        self.compact(session)
+
+    def compact(self, session: Session):
+        self.records.pop(session.session_id, None)
+        if session.state not in IN_FLIGHT_STATES \
+                and session.undelivered is None:
+            return
+        self.records[session.session_id] = SessionRecord(
+            session_id=session.session_id,
+            request_id=session.request_id,
+            state=session.state,
+            undelivered=session.undelivered
+        )
+        while len(self.records) > MAX_SESSION_RECORDS:
+            self.records.popitem(last=False)
+
+    @staticmethod
+    def close_websocket(session: Session):
+        # An evicted browser would otherwise keep sending to a session this
+        # worker forgot, the page registers again once its socket closes
+        if session.ws is not None and not session.ws.closed:
+            asyncio.ensure_future(session.ws.close())
+
+    def evict_overflow(self):
+        while len(self.sessions) > MAX_SESSIONS:
+            session_id, session = self.sessions.popitem(last=False)
+            log.debug('Evicting least recently used session',
+                      session_id=session_id)
+            self.close_websocket(session)
+            self.compact(session)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session.last_activity < SESSION_IDLE_TTL:
+                break
+            log.debug('Evicting idle session', session_id=session_id)
+            del self.sessions[session_id]
+            self.close_websocket(session)
+            self.compact(session)
+        while self.records:
+            session_id, record = next(iter(self.records.items()))
+            if now - record.updated_at < SESSION_RECORD_TTL:
+                break
+            del self.records[session_id]
+
+    async def run_eviction(self):
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            self.evict_idle()
+
+    def start_eviction(self):
+        if self.eviction_task is None:
+            self.eviction_task = asyncio.ensure_future(self.run_eviction())
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict
+
+# Upper bounds in seconds, the last bucket catches everything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+PHASES = ('db', 'rpc', 'send')
+
+# The task handling an action and the time it spent in each phase.
+# Subtasks inherit a copy of the context, only the owning task records.
+phase_timings: ContextVar = ContextVar('phase_timings', default=None)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def to_dict(self) -> dict:
+        labels = [str(b) for b in LATENCY_BUCKETS] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'buckets': dict(zip(labels, self.buckets))
+        }
+
+
+class ActionStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency': self.latency.to_dict(),
+            'phases': {phase: histogram.to_dict()
+                       for phase, histogram in self.phases.items()}
+        }
+
+
+class Metrics(object):
+    actions: Dict[str, ActionStats]
+    gauges: Dict[str, Callable]
+
+    def __init__(self):
+        self.actions = {}
+        self.gauges = {}
+
+    @contextmanager
+    def track_action(self, action: str):
+        stats = self.actions.setdefault(action, ActionStats())
+        timings = {phase: 0.0 for phase in PHASES}
+        token = phase_timings.set((asyncio.current_task(), timings))
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.count += 1
+            stats.latency.observe(time.perf_counter() - started)
+            for phase, seconds in timings.items():
+                stats.phases[phase].observe(seconds)
+            phase_timings.reset(token)
+
+    def register_gauge(self, name: str, read: Callable):
+        # Gauges are read when the stats are requested
+        self.gauges[name] = read
+
+    def to_dict(self) -> dict:
+        return {
+            'actions': {action: stats.to_dict()
+                        for action, stats in self.actions.items()},
+            'gauges': {name: read() for name, read in self.gauges.items()}
+        }
+
+
+@contextmanager
+def track_phase(phase: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        owner = phase_timings.get()
+        if owner is not None and owner[0] is asyncio.current_task():
+            owner[1][phase] += time.perf_counter() - started
+
+
+metrics = Metrics()
@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import qrcode
+from flask_qrcode import QRcode
+from qrcode.image.svg import SvgPathImage
+
+QR_CODE_BORDER = 10
+
+# QR codes are rendered with PIL, which holds the GIL, so they go to
+# separate processes instead of the thread pools
+QR_POOL_SIZE = 2
+MAX_PENDING_QR_CODES = 64
+
+# Created on first use, so importing this module starts no processes
+qr_executor = None
+
+pending_qr_codes = None
+
+
+def render_png(uri: str) -> dict:
+    return {'qrcode': QRcode.qrcode(uri, border=QR_CODE_BORDER)}
+
+
+def render_svg(uri: str) -> dict:
+    image = qrcode.make(uri, border=QR_CODE_BORDER,
+                        image_factory=SvgPathImage)
+    return {'qrcode_svg': image.to_string().decode('utf8')}
+
+
+def render_matrix(uri: str) -> dict:
+    # One string of 0 and 1 per row, the browser draws it with the border
+    code = qrcode.QRCode(border=0)
+    code.add_data(uri)
+    code.make(fit=True)
+    rows = [''.join('1' if module else '0' for module in row)
+            for row in code.get_matrix()]
+    return {
+        'qrcode_matrix': rows,
+        'qrcode_border': QR_CODE_BORDER
+    }
+
+
+renderers = {
+    'png': render_png,
+    'svg': render_svg,
+    'matrix': render_matrix
+}
+
+
+async def render_qr_code(uri: str, qr_format: str = 'png') -> dict:
+    global pending_qr_codes, qr_executor
+    if qr_executor is None:
+        # By now the gRPC channel and executor threads are running, and
+        # forking a process with live gRPC threads can deadlock the child
+        qr_executor = ProcessPoolExecutor(
+            max_workers=QR_POOL_SIZE,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    if pending_qr_codes is None:
+        pending_qr_codes = asyncio.Semaphore(MAX_PENDING_QR_CODES)
+    renderer = renderers.get(qr_format, render_png)
+    # The semaphore bounds the executor queue, extra requests wait here
+    async with pending_qr_codes:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(qr_executor, renderer, uri)
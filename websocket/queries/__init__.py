@@ -1,4 +1,10 @@
+from website.exchange_rate_queries import ExchangeRateQueries
+
 from .active_peer_queries import ActivePeerQueries
+from .channel_open_job_queries import ChannelOpenJobQueries
 from .channel_queries import ChannelQueries
 from .inbound_capacity_request_queries import InboundCapacityRequestQueries
+from .invoice_queries import InvoiceQueries
 from .lightning_addresses_queries import LightningAddressesQueries
+from .routing_payload_queries import RoutingPayloadQueries
+from .status_journal import StatusJournal, status_journal
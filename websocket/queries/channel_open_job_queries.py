@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytz
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func
+)
+from sqlalchemy.dialects.postgresql import insert
+
+from lnd_sql import session_scope
+
+# A running job whose lease runs out is claimed again, which recovers
+# jobs from a channel opening server that died mid-open
+JOB_LEASE = timedelta(minutes=10)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+channel_open_jobs = Table(
+    'channel_open_jobs',
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('r_hash', String, nullable=False, unique=True),
+    Column('session_id', String, nullable=False),
+    Column('remote_pubkey', String, nullable=False),
+    Column('local_funding_amount', BigInteger, nullable=False),
+    Column('sat_per_byte', BigInteger, nullable=False),
+    Column('status', String, nullable=False, default=QUEUED, index=True),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('last_error', String),
+    Column('run_after', DateTime(timezone=True), nullable=False,
+           server_default=func.now()),
+    Column('created_at', DateTime(timezone=True), nullable=False,
+           server_default=func.now()),
+    Column('updated_at', DateTime(timezone=True), nullable=False,
+           server_default=func.now())
+)
+
+
+def utcnow() -> datetime:
+    return datetime.utcnow().replace(tzinfo=pytz.utc)
+
+
+class ChannelOpenJobQueries(object):
+    @staticmethod
+    def create_table():
+        with session_scope() as session:
+            channel_open_jobs.create(bind=session.connection(),
+                                     checkfirst=True)
+
+    @staticmethod
+    def enqueue(r_hash: str, session_id: str, remote_pubkey: str,
+                local_funding_amount: int, sat_per_byte: int):
+        # The r_hash makes enqueueing the same paid invoice twice a no-op
+        with session_scope() as session:
+            session.execute(
+                insert(channel_open_jobs).values(
+                    r_hash=r_hash,
+                    session_id=session_id,
+                    remote_pubkey=remote_pubkey,
+                    local_funding_amount=local_funding_amount,
+                    sat_per_byte=sat_per_byte,
+                    status=QUEUED,
+                    attempts=0
+                ).on_conflict_do_nothing(index_elements=['r_hash'])
+            )
+
+    @staticmethod
+    def claim() -> Optional[dict]:
+        now = utcnow()
+        with session_scope() as session:
+            record = (
+                session.query(channel_open_jobs)
+                    .filter(channel_open_jobs.c.status.in_((QUEUED, RUNNING)))
+                    .filter(channel_open_jobs.c.run_after <= now)
+                    .order_by(channel_open_jobs.c.run_after)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                    .first()
+            )
+            if record is None:
+                return None
+            # noinspection PyProtectedMember
+            job = record._asdict()
+            job['attempts'] += 1
+            session.execute(
+                channel_open_jobs.update()
+                    .where(channel_open_jobs.c.id == job['id'])
+                    .values(status=RUNNING,
+                            attempts=job['attempts'],
+                            run_after=now + JOB_LEASE,
+                            updated_at=now)
+            )
+            return job
+
+    @staticmethod
+    def finish(job_id: int, status: str, error: str = None,
+               run_after: datetime = None):
+        values = {
+            'status': status,
+            'last_error': error,
+            'updated_at': utcnow()
+        }
+        if run_after is not None:
+            values['run_after'] = run_after
+        with session_scope() as session:
+            session.execute(
+                channel_open_jobs.update()
+                    .where(channel_open_jobs.c.id == job_id)
+                    .values(**values)
+            )
+
+    @staticmethod
+    def get_stats() -> dict:
+        with session_scope() as session:
+            depth, oldest, committed = (
+                session.query(
+                    func.count(channel_open_jobs.c.id),
+                    func.min(channel_open_jobs.c.created_at),
+                    func.sum(channel_open_jobs.c.local_funding_amount)
+                )
+                    .filter(channel_open_jobs.c.status.in_((QUEUED, RUNNING)))
+                    .one()
+            )
+            return {
+                'depth': depth,
+                'oldest': oldest,
+                'committed': int(committed or 0)
+            }
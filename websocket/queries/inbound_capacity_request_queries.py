@@ -1,5 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Dict, List
 
 import pytz
 from sqlalchemy.orm.exc import NoResultFound
@@ -9,75 +10,70 @@ from lnd_sql.models import InboundCapacityRequest
 from website.constants import CAPACITY_FEE_RATES, EXPECTED_BYTES
 from website.logger import log
 
+UNPAID_INVOICE_STATUS = 'confirmed_chain_fee_and_invoice_sent'
+
 
 class InboundCapacityRequestQueries(object):
     @staticmethod
-    def insert(session_id: str):
+    def insert(session_id: str) -> int:
         with session_scope() as session:
             new_request = InboundCapacityRequest()
             new_request.session_id = session_id
             new_request.status = 'registered'
             session.add(new_request)
+            session.flush()
+            return new_request.id
 
     @staticmethod
-    def update_status(session_id: str, status: str):
-        with session_scope() as session:
-            request: InboundCapacityRequest = (
-                session.query(InboundCapacityRequest)
-                    .filter(InboundCapacityRequest.session_id == session_id)
-                    .order_by(InboundCapacityRequest.updated_at.desc())
-                    .first()
-            )
-            request.status = status
+    def capacity_values(capacity: int, capacity_fee_rate: Decimal) -> dict:
+        delta = [c[2] for c in CAPACITY_FEE_RATES if c[0] == capacity_fee_rate][0]
+        today = datetime.utcnow().replace(tzinfo=pytz.utc)
+        return {
+            'capacity': capacity,
+            'capacity_fee_rate': capacity_fee_rate,
+            'capacity_fee': capacity * capacity_fee_rate,
+            'keep_open_until': today + delta
+        }
 
     @staticmethod
-    def update_connection(session_id: str, remote_pubkey: str, remote_host: str,
-                          status: str):
-        with session_scope() as session:
-            request: InboundCapacityRequest = (
-                session.query(InboundCapacityRequest)
-                    .filter(InboundCapacityRequest.session_id == session_id)
-                    .order_by(InboundCapacityRequest.updated_at.desc())
-                    .first()
-            )
-            request.remote_pubkey = remote_pubkey
-            request.remote_host = remote_host
-            request.status = status
+    def transaction_fee_values(transaction_fee_rate: int,
+                               capacity_fee: Decimal) -> dict:
+        transaction_fee = transaction_fee_rate * EXPECTED_BYTES
+        return {
+            'transaction_fee_rate': transaction_fee_rate,
+            'expected_bytes': EXPECTED_BYTES,
+            'transaction_fee': transaction_fee,
+            'total_fee': capacity_fee + transaction_fee
+        }
 
     @staticmethod
-    def update_capacity(session_id: str, capacity: int,
-                        capacity_fee_rate: Decimal, status: str):
+    def update_many(updates: Dict[int, dict]):
         with session_scope() as session:
-            request: InboundCapacityRequest = (
-                session.query(InboundCapacityRequest)
-                    .filter(InboundCapacityRequest.session_id == session_id)
-                    .order_by(InboundCapacityRequest.updated_at.desc())
-                    .first()
+            session.bulk_update_mappings(
+                InboundCapacityRequest,
+                [dict(values, id=request_id)
+                 for request_id, values in updates.items()]
             )
-            request.capacity = capacity
-            request.capacity_fee_rate = capacity_fee_rate
-            request.capacity_fee = request.capacity * request.capacity_fee_rate
-            delta = [c[2] for c in CAPACITY_FEE_RATES if c[0] == capacity_fee_rate][0]
-            today = datetime.utcnow().replace(tzinfo=pytz.utc)
-            request.keep_open_until = today + delta
-            request.status = status
 
     @staticmethod
-    def update_tx_fee_and_invoice(session_id: str, transaction_fee_rate: int,
-                                  r_hash: str, status: str):
+    def get_unpaid_invoices(updated_since: datetime) -> List[dict]:
+        # A request's row is stamped when its invoice is recorded and again
+        # when it leaves the unpaid status, so older rows have expired
         with session_scope() as session:
-            icr: InboundCapacityRequest = (
-                session.query(InboundCapacityRequest)
-                    .filter(InboundCapacityRequest.session_id == session_id)
-                    .order_by(InboundCapacityRequest.updated_at.desc())
-                    .first()
+            query = session.query(
+                InboundCapacityRequest.session_id,
+                InboundCapacityRequest.remote_pubkey,
+                InboundCapacityRequest.total_fee,
+                InboundCapacityRequest.transaction_fee_rate,
+                InboundCapacityRequest.capacity,
+                InboundCapacityRequest.invoice_r_hash
+            ).filter(
+                InboundCapacityRequest.invoice_r_hash.isnot(None),
+                InboundCapacityRequest.status == UNPAID_INVOICE_STATUS,
+                InboundCapacityRequest.updated_at >= updated_since
             )
-            icr.transaction_fee_rate = transaction_fee_rate
-            icr.expected_bytes = EXPECTED_BYTES
-            icr.transaction_fee = icr.transaction_fee_rate * EXPECTED_BYTES
-            icr.total_fee = icr.capacity_fee + icr.transaction_fee
-            icr.invoice_r_hash = r_hash
-            icr.status = status
+            # noinspection PyProtectedMember
+            return [record._asdict() for record in query.all()]
 
     @staticmethod
     def get_by_invoice(r_hash: str) -> dict:
@@ -0,0 +1,182 @@
+import csv
+import io
+from datetime import datetime
+from typing import List, Optional
+
+import pytz
+from google.protobuf.descriptor import FieldDescriptor
+from postgres_copy import copy_from
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    and_,
+    func,
+    or_,
+    select
+)
+from sqlalchemy.dialects.postgresql import insert
+
+from lnd_sql import session_scope
+from lnd_sql.models import Invoices
+
+HANDLED_SETTLE_INDEX = 'handled_settle_index'
+
+# Progress of the invoice server that the invoices table cannot tell, its
+# rows are written before a settled invoice is fully handled
+invoice_server_state = Table(
+    'invoice_server_state',
+    MetaData(),
+    Column('name', String, primary_key=True),
+    Column('value', BigInteger, nullable=False)
+)
+
+
+def mirrored_columns(invoice) -> list:
+    # Columns of the invoices table that map onto a scalar field of the
+    # Invoice message, plus the local_pubkey the upsert script also stores
+    fields = invoice.DESCRIPTOR.fields_by_name
+    columns = []
+    for column in Invoices.__table__.columns:
+        if column.name == 'local_pubkey':
+            columns.append(column)
+            continue
+        field = fields.get(column.name, None)
+        if field is None:
+            continue
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            continue
+        if field.type == FieldDescriptor.TYPE_MESSAGE:
+            continue
+        columns.append(column)
+    return columns
+
+
+def invoice_row(invoice, columns: list, local_pubkey: str) -> list:
+    row = []
+    for column in columns:
+        if column.name == 'local_pubkey':
+            row.append(local_pubkey)
+            continue
+        value = getattr(invoice, column.name)
+        if isinstance(value, bytes):
+            value = value.hex()
+        elif isinstance(column.type, DateTime):
+            value = datetime.fromtimestamp(value, pytz.utc) if value else None
+        row.append(value)
+    return row
+
+
+class InvoiceQueries(object):
+    @staticmethod
+    def create_table():
+        with session_scope() as session:
+            invoice_server_state.create(bind=session.connection(),
+                                        checkfirst=True)
+
+    @staticmethod
+    def get_handled_settle_index() -> Optional[int]:
+        with session_scope() as session:
+            return (
+                session.query(invoice_server_state.c.value)
+                    .filter(invoice_server_state.c.name == HANDLED_SETTLE_INDEX)
+                    .scalar()
+            )
+
+    @staticmethod
+    def set_handled_settle_index(settle_index: int):
+        with session_scope() as session:
+            statement = insert(invoice_server_state).values(
+                name=HANDLED_SETTLE_INDEX,
+                value=settle_index
+            )
+            session.execute(statement.on_conflict_do_update(
+                index_elements=['name'],
+                set_={'value': statement.excluded.value}
+            ))
+
+    @staticmethod
+    def get_catch_up_cursor() -> dict:
+        handled_settle_index = InvoiceQueries.get_handled_settle_index()
+        with session_scope() as session:
+            add_index, settle_index = session.query(
+                func.max(Invoices.add_index),
+                func.max(Invoices.settle_index)
+            ).one()
+            # Settled invoices are handled concurrently, so the highest
+            # settle index in the table can be past one whose handling was
+            # cut short. The recorded watermark is where handling resumes
+            if handled_settle_index is not None:
+                settle_index = handled_settle_index
+            # Only invoices that could still be paid, or settled past the
+            # watermark, can need handling after a restart, so paging
+            # starts at the oldest of those. Expired invoices keep a zero
+            # settle index forever and would pin paging to the oldest one
+            expires_at = (Invoices.creation_date
+                          + func.make_interval(0, 0, 0, 0, 0, 0,
+                                               Invoices.expiry))
+            unsettled = or_(Invoices.settle_index.is_(None),
+                            Invoices.settle_index == 0)
+            first_open = (
+                session.query(func.min(Invoices.add_index))
+                    .filter(or_(and_(unsettled, expires_at > func.now()),
+                                Invoices.settle_index > (settle_index or 0)))
+                    .scalar()
+            )
+            add_index = add_index or 0
+            return {
+                'add_index': add_index,
+                'settle_index': settle_index or 0,
+                'index_offset': first_open - 1 if first_open else add_index
+            }
+
+    @staticmethod
+    def bulk_upsert(invoices: List, local_pubkey: str):
+        if not invoices:
+            return
+        table = Invoices.__table__
+        columns = mirrored_columns(invoices[0])
+        names = [column.name for column in columns]
+        fields = invoices[0].DESCRIPTOR.fields_by_name
+        text_names = {
+            name for name in names
+            if name in fields and fields[name].type in (
+                FieldDescriptor.TYPE_STRING, FieldDescriptor.TYPE_BYTES
+            )
+        }
+
+        source = io.StringIO()
+        writer = csv.writer(source)
+        for invoice in invoices:
+            writer.writerow(invoice_row(invoice, columns, local_pubkey))
+        source.seek(0)
+
+        staging = Table(
+            'invoice_staging',
+            MetaData(),
+            *[Column(column.name, column.type) for column in columns],
+            prefixes=['TEMPORARY'],
+            postgresql_on_commit='DROP'
+        )
+        with session_scope() as session:
+            connection = session.connection()
+            staging.create(connection)
+            copy_from(source, staging, connection, columns=names,
+                      format='csv')
+            # Unquoted empty CSV fields load as NULL, protobuf strings are
+            # never NULL
+            values = [
+                func.coalesce(column, '') if column.name in text_names
+                else column
+                for column in staging.columns
+            ]
+            # Invoices already mirrored keep their id and get one update
+            statement = insert(table).from_select(names, select(values))
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=['r_hash'],
+                set_={name: statement.excluded[name]
+                      for name in names if name != 'r_hash'}
+            ))
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytz
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    Table,
+    Text,
+    func
+)
+
+from lnd_sql import session_scope
+
+# Every worker reads a payload, so rows are not deleted on read but once
+# they are older than this
+PAYLOAD_TTL = timedelta(minutes=10)
+
+routing_payloads = Table(
+    'routing_payloads',
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('payload', Text, nullable=False),
+    Column('created_at', DateTime(timezone=True), nullable=False,
+           server_default=func.now())
+)
+
+
+class RoutingPayloadQueries(object):
+    @staticmethod
+    def create_table():
+        with session_scope() as session:
+            routing_payloads.create(bind=session.connection(),
+                                    checkfirst=True)
+
+    @staticmethod
+    def store(payload: str) -> int:
+        expired = datetime.utcnow().replace(tzinfo=pytz.utc) - PAYLOAD_TTL
+        with session_scope() as session:
+            session.execute(
+                routing_payloads.delete()
+                    .where(routing_payloads.c.created_at < expired)
+            )
+            return session.execute(
+                routing_payloads.insert()
+                    .values(payload=payload)
+                    .returning(routing_payloads.c.id)
+            ).scalar()
+
+    @staticmethod
+    def get(payload_id: int) -> Optional[str]:
+        with session_scope() as session:
+            return (
+                session.query(routing_payloads.c.payload)
+                    .filter(routing_payloads.c.id == payload_id)
+                    .scalar()
+            )
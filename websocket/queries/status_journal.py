@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Set
+
+import pytz
+
+from website.logger import log
+from websocket.executors import run_query
+from websocket.queries.inbound_capacity_request_queries import (
+    InboundCapacityRequestQueries
+)
+
+# Transitions that involve money are flushed before the caller continues
+DURABLE_STATUSES = (
+    'confirmed_chain_fee_and_invoice_sent',
+    'payment_received',
+    'channel_opened'
+)
+
+FLUSH_INTERVAL = 0.5
+
+# Failed flushes after which a row is dropped to the error log
+MAX_ROW_FAILURES = 5
+
+
+class StatusJournal(object):
+    # inbound_capacity_request id: coalesced column values to write
+    pending: Dict[int, dict]
+    # inbound_capacity_request id: flushes its row has failed in a row
+    failures: Dict[int, int]
+
+    def __init__(self):
+        self.pending = {}
+        self.failures = {}
+        self.flush_lock = None
+        self.task = None
+
+    async def record(self, request_id: int, values: dict):
+        values['updated_at'] = datetime.utcnow().replace(tzinfo=pytz.utc)
+        self.pending.setdefault(request_id, {}).update(values)
+        if values.get('status', None) in DURABLE_STATUSES:
+            failed = await self.flush()
+            if request_id in failed:
+                raise RuntimeError(f'Status of capacity request {request_id} '
+                                   f'was not saved')
+        else:
+            self.start()
+
+    def requeue(self, request_id: int, values: dict):
+        failures = self.failures.get(request_id, 0) + 1
+        if failures >= MAX_ROW_FAILURES:
+            # Dropped so that one bad row cannot hold back every later flush
+            log.error('Dropping status journal row', request_id=request_id,
+                      values=values, failures=failures)
+            self.failures.pop(request_id, None)
+            return
+        self.failures[request_id] = failures
+        # Put the row back under any newer values and retry later
+        values.update(self.pending.get(request_id, {}))
+        self.pending[request_id] = values
+
+    async def flush(self) -> Set[int]:
+        # Returns the ids whose rows could not be written
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            if not self.pending:
+                return set()
+            batch, self.pending = self.pending, {}
+            try:
+                await run_query(InboundCapacityRequestQueries.update_many,
+                                batch)
+                for request_id in batch:
+                    self.failures.pop(request_id, None)
+                return set()
+            except Exception:
+                log.error('Status journal flush failed, retrying row by row',
+                          exc_info=True, rows=len(batch))
+            failed = set()
+            for request_id, values in batch.items():
+                try:
+                    await run_query(InboundCapacityRequestQueries.update_many,
+                                    {request_id: values})
+                except Exception:
+                    log.error('Status journal row failed', exc_info=True,
+                              request_id=request_id)
+                    failed.add(request_id)
+                    self.requeue(request_id, values)
+                    continue
+                self.failures.pop(request_id, None)
+            return failed
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                log.error('Status journal flush failed', exc_info=True,
+                          pending=len(self.pending))
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def update_status(self, request_id: int, status: str):
+        await self.record(request_id, {'status': status})
+
+    async def update_connection(self, request_id: int, remote_pubkey: str,
+                                remote_host: str, status: str):
+        await self.record(request_id, {
+            'remote_pubkey': remote_pubkey,
+            'remote_host': remote_host,
+            'status': status
+        })
+
+    async def update_capacity(self, request_id: int, capacity: int,
+                              capacity_fee_rate: Decimal, status: str):
+        values = InboundCapacityRequestQueries.capacity_values(
+            capacity=capacity,
+            capacity_fee_rate=capacity_fee_rate
+        )
+        values['status'] = status
+        await self.record(request_id, values)
+
+    async def update_tx_fee_and_invoice(self, request_id: int,
+                                        transaction_fee_rate: int,
+                                        capacity_fee: Decimal,
+                                        r_hash: str, status: str):
+        values = InboundCapacityRequestQueries.transaction_fee_values(
+            transaction_fee_rate=transaction_fee_rate,
+            capacity_fee=capacity_fee
+        )
+        values['invoice_r_hash'] = r_hash
+        values['status'] = status
+        await self.record(request_id, values)
+
+
+status_journal = StatusJournal()
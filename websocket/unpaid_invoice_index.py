@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import pytz
+
+from website.logger import log
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import InboundCapacityRequestQueries
+
+# The payment request reaches the client before the journal writes the
+# invoice, so a payment can beat the next poll; those fall back to SQL by memo
+POLL_INTERVAL = 1
+
+# Capacity request invoices use LND's default expiry, the margin covers the
+# time between the invoice being added and its row being stamped
+INVOICE_EXPIRY = timedelta(hours=1)
+EXPIRY_MARGIN = timedelta(minutes=5)
+
+
+class UnpaidInvoiceIndex(object):
+    # invoice r_hash: capacity request
+    requests: Dict[str, dict]
+
+    def __init__(self):
+        self.requests = {}
+        self.task = None
+        metrics.register_gauge('unpaid_invoice_index_size',
+                               lambda: len(self.requests))
+
+    async def load(self):
+        # Reloaded whole rather than from a high water mark on updated_at.
+        # Journal rows are stamped before they commit, by several workers,
+        # so a row can commit below a mark that was already read
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        records = await run_query(
+            InboundCapacityRequestQueries.get_unpaid_invoices,
+            updated_since=now - INVOICE_EXPIRY - EXPIRY_MARGIN
+        )
+        self.requests = {record.pop('invoice_r_hash'): record
+                         for record in records}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                await self.load()
+            except Exception:
+                log.error('Unpaid invoice index poll failed', exc_info=True)
+
+    async def start(self):
+        await self.load()
+        log.debug('Loaded unpaid invoice index', invoices=len(self.requests))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def pop(self, r_hash: str) -> Optional[dict]:
+        return self.requests.pop(r_hash, None)
@@ -1,11 +1,12 @@
 import uuid
 
-from website.constants import keyring
+from website.constants import get_keyring
 from website.logger import log
 
 
 def get_server_id(server_name: str):
     log.debug('getting server id', server_name=server_name)
+    keyring = get_keyring()
     server_id = keyring.get_password(
         service=server_name + '_server_id',
         username=server_name + '_server_id',
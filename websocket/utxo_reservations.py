@@ -0,0 +1,141 @@
+import asyncio
+import time
+from typing import Dict, List
+
+from website.logger import log
+from websocket.async_client import AsyncClient
+from websocket.executors import run_query
+from websocket.metrics import metrics
+from websocket.queries import ChannelOpenJobQueries
+
+REFRESH_INTERVAL = 30
+
+# Opens spend unconfirmed outputs, so they count as liquidity
+MIN_CONFS = 0
+MAX_CONFS = 2 ** 31 - 1
+
+# Segwit v0 funding transaction sizes in vbytes
+TX_OVERHEAD = 10.5
+P2WPKH_INPUT = 68
+P2WSH_OUTPUT = 43
+P2WPKH_OUTPUT = 31
+
+
+class InsufficientLiquidity(Exception):
+    pass
+
+
+def funding_fee(inputs: int, sat_per_byte: int) -> int:
+    vbytes = (TX_OVERHEAD + inputs * P2WPKH_INPUT + P2WSH_OUTPUT
+              + P2WPKH_OUTPUT)
+    return int(vbytes * sat_per_byte) + 1
+
+
+class UtxoReservations(object):
+    # outpoint: amount in satoshis
+    utxos: Dict[str, int]
+    # reservation key: outpoints set aside for it. LND still selects the
+    # inputs itself, these only keep the books until the next refresh
+    reservations: Dict[str, List[str]]
+
+    def __init__(self, rpc: AsyncClient, track_queued_jobs: bool = False):
+        self.rpc = rpc
+        # The website does not reserve outputs itself, it subtracts what
+        # the channel open queue has already committed
+        self.track_queued_jobs = track_queued_jobs
+        self.utxos = {}
+        self.reservations = {}
+        self.committed = 0
+        self.wallet_balance = None
+        self.synced_at = None
+        self.lock = None
+        self.task = None
+        metrics.register_gauge('wallet_balance', lambda: self.wallet_balance)
+        metrics.register_gauge('wallet_available', self.available)
+        metrics.register_gauge('wallet_reserved', self.reserved)
+
+    def reserved_outpoints(self) -> set:
+        return {outpoint for outpoints in self.reservations.values()
+                for outpoint in outpoints}
+
+    def reserved(self) -> int:
+        return sum(self.utxos.get(outpoint, 0)
+                   for outpoint in self.reserved_outpoints())
+
+    def available(self) -> int:
+        reserved = self.reserved_outpoints()
+        unreserved = sum(amount for outpoint, amount in self.utxos.items()
+                         if outpoint not in reserved)
+        return max(unreserved - self.committed, 0)
+
+    def can_fund(self, amount: int) -> bool:
+        # Until the first refresh the request is let through, the channel
+        # open queue retries it if the wallet turns out to be short
+        if self.synced_at is None:
+            return True
+        return amount <= self.available()
+
+    async def refresh(self):
+        response = await self.rpc.list_unspent(min_confs=MIN_CONFS,
+                                               max_confs=MAX_CONFS)
+        self.utxos = {
+            f'{utxo.outpoint.txid_str}:{utxo.outpoint.output_index}':
+                utxo.amount_sat
+            for utxo in response.utxos
+        }
+        balance = await self.rpc.wallet_balance()
+        self.wallet_balance = balance.total_balance
+        if self.track_queued_jobs:
+            stats = await run_query(ChannelOpenJobQueries.get_stats)
+            self.committed = stats['committed']
+        # Outputs that were spent or locked elsewhere are no longer
+        # held by their reservation
+        for key, outpoints in self.reservations.items():
+            self.reservations[key] = [o for o in outpoints if o in self.utxos]
+        self.synced_at = time.monotonic()
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                log.error('Wallet refresh failed', exc_info=True)
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def reserve(self, key: str, amount: int,
+                      sat_per_byte: int) -> List[str]:
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.synced_at is None:
+                await self.refresh()
+            reserved = self.reserved_outpoints()
+            candidates = sorted(
+                ((outpoint, value) for outpoint, value in self.utxos.items()
+                 if outpoint not in reserved),
+                key=lambda u: u[1],
+                reverse=True
+            )
+            selected = []
+            total = 0
+            for outpoint, value in candidates:
+                selected.append(outpoint)
+                total += value
+                if total >= amount + funding_fee(len(selected),
+                                                 sat_per_byte):
+                    self.reservations[key] = selected
+                    return selected
+            raise InsufficientLiquidity(
+                f'not enough unreserved wallet outputs for {amount} sat, '
+                f'{total} sat available'
+            )
+
+    def release(self, key: str, spent: bool):
+        outpoints = self.reservations.pop(key, [])
+        if spent:
+            for outpoint in outpoints:
+                self.utxos.pop(outpoint, None)
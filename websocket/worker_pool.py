@@ -0,0 +1,65 @@
+import asyncio
+import zlib
+from typing import Callable, List
+
+from website.logger import log
+
+INITIAL_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+class KeyedWorkerPool(object):
+    # Items with the same key always go to the same worker, so they are
+    # handled in order while different keys are handled concurrently
+    queues: List[asyncio.Queue]
+
+    def __init__(self, handler: Callable, workers: int, max_pending: int):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queues = []
+        self.tasks = []
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queues = [asyncio.Queue(maxsize=self.max_pending)
+                       for _ in range(self.workers)]
+        self.tasks = [asyncio.ensure_future(self.work(queue))
+                      for queue in self.queues]
+
+    async def submit(self, key: bytes, item):
+        # Waits while the worker's queue is full, which holds back the caller
+        shard = zlib.crc32(key) % self.workers
+        await self.queues[shard].put(item)
+
+    async def handle(self, item):
+        # Items are never dropped, a failing one is retried and holds back
+        # the items behind it on the same worker
+        retry_delay = INITIAL_RETRY_DELAY
+        while True:
+            try:
+                await self.handler(item)
+                return
+            except Exception:
+                log.error('Worker failed to handle item', exc_info=True,
+                          retry_delay=retry_delay)
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+
+    async def work(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self.handle(item)
+            finally:
+                queue.task_done()
+
+    async def join(self):
+        for queue in self.queues:
+            await queue.join()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []